@@ -22,7 +22,7 @@ requirements = [
     'pypubsub >= 3.1.2',
     'pyusb >= 1.0.0a3', 
     'bitstring >= 3.1.1', 
-    'intelhex >= 1.4',
+    'intelhex >= 2.1',
 ]
 
 test_requirements = [  # TODO: put package test requirements here
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_flashdev
+----------------------------------
+
+Tests for overlaying hex data onto the blocks of a `xstools.flashdev.FlashDevice`.
+"""
+
+import random
+import unittest
+
+from intelhex import IntelHex
+
+from xstools.flashdev import FlashDevice
+
+
+class FakeFlash(FlashDevice):
+
+    """Flash held in a byte array that records the blocks that get erased."""
+
+    device_name = 'Fake'
+    _START_ADDR = 0
+    _END_ADDR = 4096
+    _ERASE_BLK_SZ = 256
+    _WRITE_BLK_SZ = 64
+    _READ_BLK_SZ = 128
+
+    def __init__(self):
+        rand = random.Random(1)
+        self.mem = bytearray(rand.randint(0, 255) for i in range(self._END_ADDR))
+        self.erased = []  # Addresses of the erased blocks in the order they were erased.
+
+    def erase_blk(self, addr):
+        self.erased.append(addr)
+        self.mem[addr:addr + self._ERASE_BLK_SZ] = bytearray([0xff] * self._ERASE_BLK_SZ)
+
+    def write_blk(self, addr, data):
+        data = bytearray(data)
+        for i in range(len(data)):
+            self.mem[addr + i] &= data[i]  # Programming can only clear bits.
+
+    def read_blk(self, addr, num_bytes):
+        return bytearray(self.mem[addr:addr + num_bytes])
+
+
+class TestFlashDevice(unittest.TestCase):
+
+    def setUp(self):
+        self.flash = FakeFlash()
+        # Segments with unaligned starts and ends, gaps inside a block and a segment that spans blocks.
+        self.hexfile = IntelHex()
+        for (start, end) in [(300, 310), (320, 333), (500, 1030), (2051, 2052)]:
+            for addr in range(start, end):
+                self.hexfile[addr] = addr * 7 & 0xff
+
+    def expected(self, background):
+        """Return the flash contents expected after overlaying the hex data on a background."""
+
+        data = bytearray(background)
+        for (start, end) in self.hexfile.segments():
+            data[start:end] = self.hexfile.gets(start, end - start)
+        return data
+
+    def test_blk_pieces(self):
+        blks = list(self.flash._hex_blk_pieces(self.hexfile, 0, 4096, 256))
+        self.assertEqual([addr for (addr, pieces) in blks], [256, 512, 768, 1024, 2048])
+        self.assertEqual([(a, len(data)) for (a, data) in blks[0][1]], [(300, 10), (320, 13), (500, 12)])
+        self.assertEqual([(a, len(data)) for (a, data) in blks[3][1]], [(1024, 6)])
+        # The bounds clip the segments.
+        blks = list(self.flash._hex_blk_pieces(self.hexfile, 305, 1025, 256))
+        self.assertEqual(blks[0][1][0], (305, self.hexfile.gets(305, 5)))
+        self.assertEqual(blks[-1], (1024, [(1024, self.hexfile.gets(1024, 1))]))
+
+    def test_hex_blks(self):
+        for (addr, blk) in self.flash._hex_blks(self.hexfile, 0, 4096, 256):
+            self.assertEqual(bytearray(blk), self.expected(bytearray([0xff] * 4096))[addr:addr + 256])
+
+    def test_program(self):
+        self.flash.program(self.hexfile)
+        # Blocks without hex data are erased, and bytes in the gaps between segments are left erased.
+        self.assertEqual(self.flash.mem, self.expected(bytearray([0xff] * 4096)))
+
+    def test_update(self):
+        original = bytearray(self.flash.mem)
+        self.assertEqual(self.flash.update(self.hexfile), 5)
+        # Flash contents outside the hex data are kept.
+        self.assertEqual(self.flash.mem, self.expected(original))
+        self.assertEqual(self.flash.compare(self.hexfile), [])
+        # Only the blocks that differ are rewritten.
+        self.flash.mem[700] ^= 0xff
+        self.flash.mem[1500] ^= 0xff  # Not in the hex data.
+        self.flash.erased = []
+        self.assertEqual(self.flash.update(self.hexfile), 1)
+        self.assertEqual(self.flash.erased, [512])
+
+    def test_compare(self):
+        self.flash.program(self.hexfile)
+        for addr in [310, 315, 700, 701, 1500]:
+            self.flash.mem[addr] ^= 0x01
+        # Mismatches in the gaps between segments don't count.
+        self.assertEqual(self.flash.compare(self.hexfile, max_gap=1), [(700, 702, 2)])
+        self.assertEqual(self.flash.compare(self.hexfile, bottom=1024), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
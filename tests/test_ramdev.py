@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_ramdev
+----------------------------------
+
+Tests for writing hex data into a `xstools.ramdev.RamDevice`.
+"""
+
+import struct
+import unittest
+
+from intelhex import IntelHex
+
+from xstools.xserror import XsMinorError
+from xstools.ramdev import RamDevice
+
+
+class RamRecorder(object):
+
+    """Stand-in for the XsMemIo object of a RAM that holds the words in a list."""
+
+    def __init__(self, num_words, word_size):
+        self.max_xfer_words = 16
+        self.mem = [(i * 0x01030507) & ((1 << 8 * word_size) - 1) for i in range(num_words)]
+        self.num_reads = 0  # Number of words read from the RAM.
+
+    def read_many(self, ranges, return_type=int()):
+        self.num_reads += sum(n for (addr, n) in ranges)
+        return [self.mem[addr:addr + n] for (addr, n) in ranges]
+
+    def read(self, addr, n, return_type=int()):
+        return self.read_many([(addr, n)])[0]
+
+    def write_many(self, ranges):
+        for (addr, data) in ranges:
+            self.mem[addr:addr + len(data)] = list(data)
+
+    def write(self, addr, data):
+        self.write_many([(addr, data)])
+
+
+class FakeSdram(RamDevice):
+
+    """Small RAM with 16-bit, big-endian words like the SDRAM."""
+
+    _START_ADDR = 0
+    _END_ADDR = 1023
+    _WORD_SIZE = 2
+    _WORD_TYPE = 'H'
+    _WORD_ENDIAN = '>'
+    _DEVICE_NAME = 'Fake SDRAM'
+
+    def __init__(self):
+        self._ram = RamRecorder((self._END_ADDR + 1) / self._WORD_SIZE, self._WORD_SIZE)
+
+    def image(self):
+        """Return the RAM contents as a byte array."""
+
+        word_format = self._WORD_ENDIAN + str(len(self._ram.mem)) + self._WORD_TYPE
+        return bytearray(struct.pack(word_format, *self._ram.mem))
+
+
+class FakeWideRam(FakeSdram):
+
+    """Small RAM with 32-bit, little-endian words."""
+
+    _WORD_SIZE = 4
+    _WORD_TYPE = 'I'
+    _WORD_ENDIAN = '<'
+
+
+class TestRamDevice(unittest.TestCase):
+
+    ram_classes = (FakeSdram, FakeWideRam)
+
+    def make_hex(self, segments):
+        hexfile = IntelHex()
+        for (start, end) in segments:
+            for addr in range(start, end):
+                hexfile[addr] = (addr * 11 + 1) & 0xff
+        return hexfile
+
+    def overlay(self, data, hexfile, bottom=0, top=1023):
+        data = bytearray(data)
+        for (start, end) in hexfile.segments():
+            (start, end) = (max(start, bottom), min(end, top + 1))
+            if start < end:
+                data[start:end] = hexfile.gets(start, end - start)
+        return data
+
+    def test_write_unaligned(self):
+        # Segments with unaligned starts and ends, gaps within a word and across words,
+        # and segments that end up in adjacent words.
+        segments = [(1, 2), (3, 8), (9, 10), (13, 30), (31, 33), (35, 36), (100, 103), (1021, 1024)]
+        hexfile = self.make_hex(segments)
+        for ram_class in self.ram_classes:
+            ram = ram_class()
+            original = ram.image()
+            ram.write(hexfile)
+            self.assertEqual(ram.image(), self.overlay(original, hexfile))
+
+    def test_write_aligned_skips_reads(self):
+        hexfile = self.make_hex([(0, 16), (64, 80)])
+        for ram_class in self.ram_classes:
+            ram = ram_class()
+            original = ram.image()
+            ram.write(hexfile)
+            self.assertEqual(ram._ram.num_reads, 0)
+            self.assertEqual(ram.image(), self.overlay(original, hexfile))
+
+    def test_write_bounds(self):
+        hexfile = self.make_hex([(0, 40), (50, 90)])
+        for ram_class in self.ram_classes:
+            ram = ram_class()
+            original = ram.image()
+            ram.write(hexfile, 3, 62)
+            self.assertEqual(ram.image(), self.overlay(original, hexfile, 3, 62))
+            self.assertRaises(XsMinorError, ram.write, hexfile, 41, 48)
+            self.assertRaises(XsMinorError, ram.write, IntelHex())
+
+    def test_fill_patterns(self):
+        # Patterns that aren't a multiple of the word size, over sections spanning several blocks.
+        for ram_class in self.ram_classes:
+            for pattern in [0x5a, [1, 2, 3], '\x10\x20\x30\x40\x50', bytearray(range(7)), (9, 8)]:
+                for (bottom, top) in [(0, 1023), (8, 207), (16, 19)]:
+                    ram = ram_class()
+                    original = ram.image()
+                    ram.fill(bottom, top, pattern)
+                    pattern_bytes = bytearray([pattern] if isinstance(pattern, int) else pattern)
+                    num_bytes = top - bottom + 1
+                    expected = (pattern_bytes * (num_bytes // len(pattern_bytes) + 1))[:num_bytes]
+                    self.assertEqual(ram.image(), original[:bottom] + expected + original[top + 1:])
+
+    def test_erase(self):
+        ram = FakeSdram()
+        original = ram.image()
+        ram.erase(2, 9)
+        self.assertEqual(ram.image(), original[:2] + bytearray([0xff] * 8) + original[10:])
+
+    def test_fill_errors(self):
+        ram = FakeSdram()
+        for pattern in [256, -1, [1, 300], [], 'a' * 0, None, 1.5]:
+            self.assertRaises(XsMinorError, ram.fill, 0, 15, pattern)
+        # The section must be a whole number of words.
+        self.assertRaises(XsMinorError, ram.fill, 1, 16, 0)
+        self.assertRaises(XsMinorError, ram.fill, 0, 14, 0)
+
+    def test_read(self):
+        ram = FakeSdram()
+        self.assertEqual(ram.read(4, 11).tobinstr(start=4, size=8), str(ram.image()[4:12]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_xsbitarray
+----------------------------------
+
+Tests that `xstools.xsbitarray.XsBitVec` and `XsBitReader` match the behavior of `XsBitArray`.
+"""
+
+import unittest
+
+from xstools.xserror import XsMinorError
+from xstools.xsbitarray import XsBitArray, XsBitVec, XsBitReader
+
+
+class TestXsBitVec(unittest.TestCase):
+
+    def setUp(self):
+        self.strs = ['0b1', '0b0110', '0b10110011101', '0x8f3c', '0b' + '10' * 40]
+
+    def test_conversions(self):
+        for s in self.strs:
+            (vec, arr) = (XsBitVec(s), XsBitArray(s))
+            self.assertEqual(vec.len, arr.len)
+            self.assertEqual(vec.bin, arr.bin)
+            if arr.len > 0:
+                self.assertEqual(vec.uint, arr.uint)
+                self.assertEqual(vec.int, arr.int)
+            self.assertEqual(vec.to_usb(), arr.to_usb())
+            self.assertEqual(XsBitVec.from_usb(arr.to_usb(), arr.len), vec)
+            self.assertEqual(vec.to_bitarray(), arr)
+            self.assertEqual(XsBitVec(arr), vec)
+
+    def test_slicing(self):
+        arr = XsBitArray('0b10110011101')
+        vec = XsBitVec(arr)
+        for (start, stop) in [(0, 11), (0, 4), (3, 9), (7, 11), (-4, None), (None, -3), (5, 5)]:
+            self.assertEqual(vec[start:stop], arr[start:stop])
+        for i in range(-arr.len, arr.len):
+            self.assertEqual(vec[i], arr[i])
+        self.assertRaises(IndexError, vec.__getitem__, arr.len)
+        self.assertEqual(vec.head(3), arr.head(3))
+        self.assertEqual(vec.tail(5), arr.tail(5))
+
+    def test_concatenation(self):
+        (a, b) = ('0b110', '0b0111001')
+        arr = XsBitArray(a) + XsBitArray(b)
+        self.assertEqual(XsBitVec(a) + XsBitVec(b), arr)
+        self.assertEqual(XsBitVec(a) + XsBitArray(b), arr)
+        self.assertEqual(XsBitArray(a) + XsBitVec(b), arr)
+        self.assertEqual(type(XsBitArray(a) + XsBitVec(b)), XsBitArray)
+        vec = XsBitVec(a)
+        vec += XsBitVec(b)
+        self.assertEqual(vec, arr)
+        self.assertEqual(XsBitVec() + XsBitVec(b), XsBitArray(b))
+
+    def test_pop_field(self):
+        (vec, arr) = (XsBitVec('0b10110011101'), XsBitArray('0b10110011101'))
+        for length in [3, 0, 5, 3]:
+            self.assertEqual(vec.pop_field(length), arr.pop_field(length))
+            self.assertEqual(vec, arr)
+
+    def test_equality_both_ways(self):
+        for s in self.strs:
+            (vec, arr) = (XsBitVec(s), XsBitArray(s))
+            self.assertTrue(vec == arr)
+            self.assertTrue(arr == vec)
+            self.assertFalse(vec != arr)
+            self.assertFalse(arr != vec)
+        # Vectors with the same value but different lengths differ.
+        (vec, arr) = (XsBitVec('0b0101'), XsBitArray('0b101'))
+        self.assertFalse(vec == arr)
+        self.assertFalse(arr == vec)
+        self.assertTrue(vec != arr)
+        self.assertTrue(arr != vec)
+        self.assertFalse(XsBitVec('0b1') == 'not bits')
+
+
+class TestXsBitReader(unittest.TestCase):
+
+    def test_read_fields(self):
+        for bit_class in (XsBitArray, XsBitVec):
+            bits = bit_class('0b1011001110100101')
+            popped = bit_class(bits)
+            reader = XsBitReader(bits)
+            for length in [4, 3, 0, 9]:
+                field = popped.pop_field(length)
+                self.assertEqual(reader.read(length), field)
+            self.assertEqual(reader.remaining(), 0)
+            # The source isn't changed by reading.
+            self.assertEqual(bits, bit_class('0b1011001110100101'))
+            self.assertRaises(XsMinorError, reader.read_uint, 1)
+
+    def test_read_uint_and_int(self):
+        for bit_class in (XsBitArray, XsBitVec):
+            reader = XsBitReader(bit_class('0b0111' + '1100' + '0101'))
+            self.assertEqual(reader.read_uint(4), 0b0101)
+            self.assertEqual(reader.read_int(4), -4)
+            self.assertEqual(reader.read_int(4), 7)
+            reader = XsBitReader(bit_class('0b10011'))
+            reader.skip(2)
+            self.assertEqual(reader.read_uint(3), 0b100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_xsjtag
+----------------------------------
+
+Tests for the JTAG bit ordering of `xstools.xsjtag` and `xstools.xshostio`.
+"""
+
+import unittest
+
+from xstools.xsusb import XsUsb
+from xstools.xsjtag import XsJtag
+from xstools.xshostio import XsHostIo
+from xstools.xsbitarray import XsBitArray
+
+
+class JtagRecorder(object):
+
+    """Stand-in for the USB port that records the TMS and TDI values sent on every TCK."""
+
+    def __init__(self):
+        self.tcks = []  # (TMS, TDI) for each TCK in the order they reached the JTAG port.
+        self.num_tdo_bytes = 0  # TDO bytes requested but not yet read.
+
+    def _bit(self, buffer, flags, put_mask, val_mask, i):
+        if flags & put_mask:
+            return buffer[i // 8] >> (i % 8) & 0x01
+        return int(flags & val_mask != 0)
+
+    def write(self, buffer):
+        buffer = bytearray(buffer)
+        pos = 0
+        while pos < len(buffer):
+            assert buffer[pos] == XsUsb.JTAG_CMD
+            num_bits = buffer[pos + 1] | buffer[pos + 2] << 8 | buffer[pos + 3] << 16 | buffer[pos + 4] << 24
+            flags = buffer[pos + 5]
+            pos += 6
+            num_bytes = (num_bits + 7) // 8
+            if flags & XsUsb.PUT_TMS_MASK and flags & XsUsb.PUT_TDI_MASK:
+                tms = buffer[pos:pos + 2 * num_bytes:2]
+                tdi = buffer[pos + 1:pos + 2 * num_bytes:2]
+                pos += 2 * num_bytes
+            else:
+                tms = tdi = buffer[pos:pos + num_bytes]
+                if flags & (XsUsb.PUT_TMS_MASK | XsUsb.PUT_TDI_MASK):
+                    pos += num_bytes
+            for i in range(num_bits):
+                self.tcks.append((self._bit(tms, flags, XsUsb.PUT_TMS_MASK, XsUsb.TMS_VAL_MASK, i),
+                                  self._bit(tdi, flags, XsUsb.PUT_TDI_MASK, XsUsb.TDI_VAL_MASK, i)))
+            if flags & XsUsb.GET_TDO_MASK:
+                self.num_tdo_bytes += num_bytes
+
+    def read(self, num_bytes):
+        assert num_bytes <= self.num_tdo_bytes
+        self.num_tdo_bytes -= num_bytes
+        return bytearray(num_bytes)
+
+
+class TestXsJtag(unittest.TestCase):
+
+    def setUp(self):
+        self.usb = JtagRecorder()
+        self.jtag = XsJtag(self.usb)
+
+    def test_send_without_results(self):
+        hostio = XsHostIo(module_id=5, xsjtag=self.jtag)
+        num_tcks = len(self.usb.tcks)
+        hostio.send_rcv(XsBitArray('0b1011'), 0)
+        # The module ID, bit count and payload must reach the JTAG port right away.
+        self.assertEqual(len(self.usb.tcks) - num_tcks, 8 + 32 + 4)
+        self.assertTrue(self.jtag._buffer_is_empty())
+
+    def test_exit_shift_after_long_tdi(self):
+        self.jtag.reset_tap()
+        self.jtag.go_thru_tap_states('Run-Test/Idle', 'Select-DR-Scan', 'Capture-DR', 'Shift-DR')
+        self.jtag.flush()
+        num_tcks = len(self.usb.tcks)
+        self.jtag.shift_tdi_usb(bytearray([0xff] * 38), 300)
+        self.jtag.shift_tdo_usb(1, do_exit_shift=True)
+        # The TDI bits must all be shifted before TMS goes high to exit the Shift-DR state.
+        self.assertEqual(self.usb.tcks[num_tcks:], [(0, 1)] * 300 + [(1, 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
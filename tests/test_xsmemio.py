@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_xsmemio
+----------------------------------
+
+Tests for the memory page cache of `xstools.xsmemio`.
+"""
+
+import unittest
+
+from xstools.xsmemio import XsMemCache
+
+
+class MemRecorder(object):
+
+    """Stand-in for an XsMemIo object that records the batches of reads and writes sent to the memory."""
+
+    def __init__(self, address_width=8, data_width=16):
+        self.address_width = address_width
+        self.data_width = data_width
+        self.mem = [(3 * i) & ((1 << data_width) - 1) for i in range(1 << address_width)]
+        self.reads = []  # List of (address, # words) ranges for each batch of reads.
+        self.writes = []  # List of (address, data) ranges for each batch of writes.
+
+    def read_many(self, ranges, return_type=int()):
+        self.reads.append(list(ranges))
+        return [self.mem[addr:addr + n] for (addr, n) in ranges]
+
+    def write_many(self, ranges):
+        self.writes.append([(addr, list(data)) for (addr, data) in ranges])
+        for (addr, data) in ranges:
+            self.mem[addr:addr + len(data)] = data
+
+
+class TestXsMemCache(unittest.TestCase):
+
+    def setUp(self):
+        self.memio = MemRecorder()
+        self.cache = XsMemCache(self.memio, page_size=16, num_pages=2)
+
+    def test_hits_and_misses(self):
+        self.assertEqual(self.cache[5], 15)
+        self.assertEqual(self.memio.reads, [[(0, 16)]])
+        # Another word from the same page is a hit.
+        self.assertEqual(self.cache[15], 45)
+        self.assertEqual(len(self.memio.reads), 1)
+        self.assertEqual(self.cache[16], 48)
+        self.assertEqual(self.memio.reads[1:], [[(16, 16)]])
+
+    def test_read_straddling_pages(self):
+        self.assertEqual(self.cache.read(10, 12), self.memio.mem[10:22])
+        # Both pages are fetched with a single batch of reads.
+        self.assertEqual(self.memio.reads, [[(0, 16), (16, 16)]])
+        # A read spanning more pages than the cache holds is split into groups that fit.
+        self.assertEqual(self.cache[8:60], self.memio.mem[8:60])
+        self.assertEqual(self.cache[0:64:7], self.memio.mem[0:64:7])
+
+    def test_dirty_eviction(self):
+        self.cache[3] = 0x1234
+        self.cache[5] = 0x5678
+        self.cache[20] = 7
+        self.assertEqual(self.memio.writes, [])
+        # Loading a third page evicts the least-recently-used page and writes back only its modified words.
+        self.cache[40]
+        self.assertEqual(self.memio.writes, [[(3, [0x1234, 12, 0x5678])]])
+        # Clean pages are dropped without being written.
+        self.cache[60]
+        self.assertEqual(self.memio.writes[1:], [[(20, [7])]])
+        self.cache[50]
+        self.assertEqual(len(self.memio.writes), 2)
+
+    def test_flush(self):
+        self.cache.write(30, [1, 2, 3, 4])
+        self.cache.flush()
+        self.assertEqual(self.memio.writes, [[(30, [1, 2]), (32, [3, 4])]])
+        self.assertEqual(self.memio.mem[30:34], [1, 2, 3, 4])
+        # Nothing is left to write after a flush.
+        self.cache.flush()
+        self.assertEqual(len(self.memio.writes), 1)
+
+    def test_context_manager_flushes(self):
+        with XsMemCache(self.memio, page_size=16) as cache:
+            cache[100:103] = [9, 8, 7]
+        self.assertEqual(self.memio.mem[100:103], [9, 8, 7])
+
+    def test_full_page_write_skips_read(self):
+        self.cache[16:32] = range(16)
+        self.assertEqual(self.memio.reads, [])
+        self.assertEqual(self.cache[16:32], range(16))
+
+    def test_invalidate(self):
+        self.cache[0] = 1
+        self.cache.invalidate(write_back=False)
+        self.assertEqual(self.memio.writes, [])
+        self.assertEqual(self.cache[0], 0)
+
+    def test_signed_values(self):
+        cache = XsMemCache(self.memio, page_size=16, return_type=-1)
+        cache[0] = -2
+        self.assertEqual(cache[0], -2)
+        cache.flush()
+        self.assertEqual(self.memio.mem[0], 0xfffe)
+
+    def test_out_of_range(self):
+        self.assertRaises(IndexError, self.cache.read, 250, 10)
+        self.assertRaises(ValueError, self.cache.__setitem__, slice(0, 4), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,11 +24,17 @@ Classes for devices containing flash memory.
 """
 
 import logging
+import bisect
 from intelhex import IntelHex
 from xserror import *
 from xsspi import *
 from xilbitstr import *      
 
+try:
+    import numpy
+except ImportError:
+    numpy = None  # Fall back to comparing mismatched chunks byte-by-byte.
+
 
 class FlashDevice:
 
@@ -55,13 +61,22 @@ class FlashDevice:
         """Erase a section of the flash."""
 
         (bottom, top) = self._set_blk_bounds(bottom, top, self._ERASE_BLK_SZ)
-        for addr in range(bottom, top, self._ERASE_BLK_SZ):
+        self.erase_blks(range(bottom, top, self._ERASE_BLK_SZ))
+
+    def erase_blks(self, addrs):
+        """Erase the flash blocks at a list of addresses."""
+
+        for addr in addrs:
             self.erase_blk(addr)
 
-    def write(self, hexfile, bottom=None, top=None):
-        """Download a hexfile into a section of the flash.
-        THE FLASH MUST ALREADY BE ERASED FOR THIS TO WORK CORRECTLY!
-        """
+    def write_blks(self, blks):
+        """Write a list of (address, data) blocks to the flash."""
+
+        for (addr, data) in blks:
+            self.write_blk(addr, data)
+
+    def _to_intel_hex(self, hexfile):
+        """Return the hex data object for a hex data object or the name of an Intel hex or Xilinx bitstream file."""
 
         # If the argument is not already a hex data object, then it must be a file name, so read the hex data from it.
         if not isinstance(hexfile, IntelHex):
@@ -77,6 +92,14 @@ class FlashDevice:
                     # Error: neither an Intel hex or Xilinx bitstream file.
                     raise XsMajorError('Unable to convert file %s for writing to %s flash.'
                                     % (hexfile, self.device_name))
+        return hexfile
+
+    def write(self, hexfile, bottom=None, top=None):
+        """Download a hexfile into a section of the flash.
+        THE FLASH MUST ALREADY BE ERASED FOR THIS TO WORK CORRECTLY!
+        """
+
+        hexfile = self._to_intel_hex(hexfile)
                                     
         if bottom == None:
             bottom = hexfile.minaddr()
@@ -87,52 +110,294 @@ class FlashDevice:
             bottom, top = (0,0)
 
         (bottom, top) = self._set_blk_bounds(bottom, top, self._WRITE_BLK_SZ)
-        for addr in range(bottom, top, self._WRITE_BLK_SZ):
-            # The tobinarray() method fills unused array locations with 0xFF so the flash at those
-            # addresses will stay unprogrammed.
-            data_blk = bytearray(hexfile.tobinarray(start=addr, size=self._WRITE_BLK_SZ))
+        blks = []
+        for (addr, data_blk) in self._hex_blks(hexfile, bottom, top, self._WRITE_BLK_SZ):
             # Don't write data blocks that only contain the value 0xFF (erased value of flash).
             if data_blk.count(chr(0xff)) != self._WRITE_BLK_SZ:
-                self.write_blk(addr, data_blk)
+                blks.append((addr, data_blk))
+        self.write_blks(blks)
 
-    def read(self, bottom=None, top=None):
+    def _hex_blk_pieces(self, hexfile, bottom, top, blk_sz):
+        """Generate (address, pieces) for only the blocks between the bottom and top addresses that hold hex data.
+        
+        pieces is a list of (address, bytes) runs of hex data within the block. The runs are cut
+        from the contiguous segments of the hex data, so the work depends on the amount of hex
+        data and not on the size of the address range.
+        """
+
+        blk_addr = None
+        for (start, end) in hexfile.segments():
+            (start, end) = (max(start, bottom), min(end, top))
+            if start >= end:
+                continue
+            data = hexfile.gets(start, end - start)
+            for addr in range(self._floor_blk_addr(start, blk_sz), end, blk_sz):
+                # Segments are sorted, so a block can only be shared with the previous segment.
+                if addr != blk_addr:
+                    if blk_addr != None:
+                        yield (blk_addr, pieces)
+                    (blk_addr, pieces) = (addr, [])
+                (lo, hi) = (max(start, addr), min(end, addr + blk_sz))
+                pieces.append((lo, data[lo - start:hi - start]))
+        if blk_addr != None:
+            yield (blk_addr, pieces)
+
+    def _overlay_pieces(self, blk, addr, pieces):
+        """Copy the (address, bytes) runs of hex data into the block of bytes starting at the given address."""
+
+        for (a, data) in pieces:
+            blk[a - addr:a - addr + len(data)] = data
+
+    def _hex_blks(self, hexfile, bottom, top, blk_sz):
+        """Generate (address, byte array) blocks for only the blocks between the bottom and top addresses that hold hex data.
+        
+        Locations in a block without hex data are filled with 0xFF so the flash at those
+        addresses will stay unprogrammed.
+        """
+
+        for (addr, pieces) in self._hex_blk_pieces(hexfile, bottom, top, blk_sz):
+            blk = bytearray([0xff] * blk_sz)
+            self._overlay_pieces(blk, addr, pieces)
+            yield (addr, blk)
+
+    def read(self, bottom=None, top=None, progress=None):
         """Return the hex data stored in a section of the flash."""
 
         (bottom, top) = self._set_blk_bounds(bottom, top, self._WRITE_BLK_SZ)
         data = bytearray()
-        for addr in range(bottom, top, self._READ_BLK_SZ):
-            data.extend(self.read_blk(addr, self._READ_BLK_SZ))
+        self.read_stream(data, bottom, top, progress)
         hex_data = IntelHex()
         hex_data[bottom:top] = [byte for byte in data]
         return hex_data
 
-    def verify(self, hexfile, bottom=None, top=None):
-        """Verify the program in the flash matches the hex file."""
+    def _read_chunks(self, bottom, top):
+        """Generate (address, byte array) chunks with the contents of the flash between the bottom and top addresses."""
 
-        # If the argument is not already a hex data object, then it must be a file name, so read the hex data from it.
-        if not isinstance(hexfile, IntelHex):
-            try:
-                hexfile_data = IntelHex(hexfile)
-                hexfile = hexfile_data
-            except:
-                raise XsMajorError('Unable to open hex file %s for verifying %s flash.'
-                                    % (hexfile, self.device_name))
+        for addr in range(bottom, top, self._READ_BLK_SZ):
+            yield (addr, self.read_blk(addr, min(self._READ_BLK_SZ, top - addr)))
+
+    def read_stream(self, dest, bottom=None, top=None, progress=None):
+        """Read a section of the flash in chunks and pass each chunk to a destination.
+        
+        dest = A byte array that is extended with the data, a file-like object the data is
+               written to, or a function that is called with the address and data of each chunk.
+        progress = A function that is called with the number of bytes read so far and
+                   the total number of bytes after each chunk is read.
+        """
+
+        if bottom == None or bottom < self._START_ADDR:
+            bottom = self._START_ADDR
+        if top == None or top > self._END_ADDR:
+            top = self._END_ADDR
+        if bottom > top:
+            raise XsMinorError('Bottom address is greater than the top address.')
+
+        if isinstance(dest, bytearray):
+            put = lambda addr, data: dest.extend(data)
+        elif hasattr(dest, 'write'):
+            put = lambda addr, data: dest.write(data)
+        else:
+            put = dest
+
+        num_bytes = top - bottom
+        num_done = 0
+        for (addr, data) in self._read_chunks(bottom, top):
+            put(addr, data)
+            num_done += len(data)
+            if progress != None:
+                progress(num_done, num_bytes)
+
+    def _read_blks(self, bottom, top):
+        """Return a byte array with the contents of the flash between the block-aligned bottom and top addresses."""
+
+        data = bytearray()
+        for (addr, chunk) in self._read_chunks(bottom, top):
+            data.extend(chunk)
+        return data
+
+    def _hex_bounds(self, hexfile, bottom, top):
+        """Default the bottom and top addresses to the range spanned by the hex data."""
+
+        if bottom == None:
+            bottom = hexfile.minaddr()
+        if top == None:
+            top = hexfile.maxaddr() + 1
+        return (bottom, top)
+
+    def _split_write_blks(self, addr, data):
+        """Split the data for an erase block into a list of (address, data) write blocks that need programming."""
 
+        blks = []
+        for offset in range(0, len(data), self._WRITE_BLK_SZ):
+            data_blk = data[offset:offset + self._WRITE_BLK_SZ]
+            # Don't write data blocks that only contain the value 0xFF (erased value of flash).
+            if data_blk.count(chr(0xff)) != len(data_blk):
+                blks.append((addr + offset, data_blk))
+        return blks
+
+    def _rewrite_blk(self, addr, data):
+        """Erase a block of the flash and write it with the given data."""
+
+        self.erase_blk(addr)
+        self.write_blks(self._split_write_blks(addr, data))
+
+    def _program_blks(self, hexfile, bottom, top, incremental, verify, retries=0):
+        """Program the erase blocks of the flash between the block-aligned bottom and top addresses in a single pass.
+        
+        Each erase block holding hex data is erased and written and then (if verify is true)
+        read back and checked before moving on to the next block. A block that doesn't verify
+        is rewritten up to the given number of retries.
+        
+        incremental = If true, the hex data is overlaid on the current contents of each block and only
+                      blocks whose contents change are rewritten. Blocks without hex data are left alone.
+                      Otherwise, blocks are rewritten with only the hex data and blocks without hex data are erased.
+        
+        Returns the number of erase blocks that were rewritten.
+        """
+
+        num_updated = 0
+        blank_bottom = bottom  # Start of the blocks without hex data that follow the last block with some.
+        for (addr, pieces) in self._hex_blk_pieces(hexfile, bottom, top, self._ERASE_BLK_SZ):
+            # Blocks without hex data are left alone or erased together.
+            if not incremental and blank_bottom < addr:
+                self.erase(blank_bottom, addr)
+            blank_bottom = addr + self._ERASE_BLK_SZ
+
+            # Overlay the hex data onto the current or erased block contents.
+            if incremental:
+                current = self._read_blks(addr, addr + self._ERASE_BLK_SZ)
+            else:
+                current = bytearray([0xff] * self._ERASE_BLK_SZ)
+            new = bytearray(current)
+            self._overlay_pieces(new, addr, pieces)
+            if incremental and new == current:
+                continue  # Block already holds the right data.
+
+            # Rewrite the block with the new contents and check it.
+            for attempt in range(retries + 1):
+                self._rewrite_blk(addr, new)
+                if not verify or self._read_blks(addr, addr + self._ERASE_BLK_SZ) == new:
+                    break
+                logging.debug('Retrying block 0x%04x of %s flash.' % (addr, self.device_name))
+            else:
+                raise XsMajorError('%s flash != hex file in block 0x%04x-0x%04x after %d attempts.'
+                                    % (self.device_name, addr, addr + self._ERASE_BLK_SZ - 1, retries + 1))
+            num_updated += 1
+
+        if not incremental and blank_bottom < top:
+            self.erase(blank_bottom, top)
+
+        logging.debug('%d erase blocks of %s flash updated.' % (num_updated, self.device_name))
+        return num_updated
+
+    def update(self, hexfile, bottom=None, top=None):
+        """Rewrite only the erase blocks of the flash whose contents differ from the hex file.
+        
+        The current contents of each erase block holding hex data are read and
+        overlaid with the hex data. A block is erased and reprogrammed only if
+        the result differs from what is already stored, and any flash contents
+        that aren't covered by the hex file are preserved.
+        Returns the number of erase blocks that were rewritten.
+        """
+
+        hexfile = self._to_intel_hex(hexfile)
+        if len(hexfile) == 0:
+            return 0
+        (bottom, top) = self._hex_bounds(hexfile, bottom, top)
+        (bottom, top) = self._set_blk_bounds(bottom, top, self._ERASE_BLK_SZ)
+        return self._program_blks(hexfile, bottom, top, incremental=True, verify=False)
+
+    def _find_mismatches(self, data, expected):
+        """Return the indices of the bytes that differ between two equal-length byte arrays."""
+
+        if numpy != None:
+            return numpy.flatnonzero(numpy.frombuffer(data, dtype=numpy.uint8)
+                                     != numpy.frombuffer(expected, dtype=numpy.uint8))
+        return [i for i in range(len(data)) if data[i] != expected[i]]
+
+    def compare(self, hexfile, bottom=None, top=None, stop_on_mismatch=False, max_gap=16):
+        """Compare the flash to the hex file and return a list of the mismatched address ranges.
+        
+        The flash is read in chunks and each chunk is compared to the hex data as a whole.
+        Only the chunks that differ are searched for the individual mismatched bytes.
+        
+        stop_on_mismatch = If true, stop reading the flash after the first chunk with a mismatch.
+        max_gap = Mismatches separated by fewer than this many matching bytes are merged into the same range.
+        
+        Returns a list of (start, end, count) tuples where start and end (exclusive) bound
+        an address range and count is the number of mismatched bytes within it.
+        """
+
+        hexfile = self._to_intel_hex(hexfile)
+
+        # Only the section of the flash holding hex data needs to be read.
         (bottom, top) = self._set_blk_bounds(bottom, top, self._WRITE_BLK_SZ)
-        flash = self.read(bottom, top)
-        errors = [(a, flash[a], hexfile[a]) for a in
-                  sorted(hexfile.todict().keys()) if flash[a]
-                  != hexfile[a] and bottom <= a < top]
-        if len(errors) > 0:
-            raise XsMajorError('%s flash != hex file at %d locations starting at address 0x%04x (0x%02x != 0x%02x)'
-                                % (self.device_name, len(errors), errors[0][0], errors[0][1], errors[0][2]))
+        segs = [(start, end) for (start, end) in hexfile.segments() if start < top and end > bottom]
+        if len(segs) == 0:
+            return []
+        bottom = max(bottom, segs[0][0])
+        top = min(top, segs[-1][1])
+        seg_ends = [end for (start, end) in segs]
+
+        ranges = []
+        chunks = self._read_chunks(bottom, top)
+        try:
+            for (addr, data) in chunks:
+                expected = bytearray(hexfile.tobinstr(start=addr, size=len(data)))
+                if data == expected:
+                    continue
 
-    def program(self, hexfile, bottom=None, top=None):
-        """Erase, write and verify the flash with the contents of the hex file."""
+                # Search only the hex segments in this chunk. Mismatches at other addresses don't count.
+                mismatch_found = False
+                for (start, end) in segs[bisect.bisect_right(seg_ends, addr):]:
+                    if start >= addr + len(data):
+                        break
+                    (lo, hi) = (max(start, addr) - addr, min(end, addr + len(data)) - addr)
+                    for i in self._find_mismatches(data[lo:hi], expected[lo:hi]):
+                        a = addr + lo + int(i)
+                        mismatch_found = True
+                        if len(ranges) != 0 and a - ranges[-1][1] < max_gap:
+                            ranges[-1][1] = a + 1
+                            ranges[-1][2] += 1
+                        else:
+                            ranges.append([a, a + 1, 1])
+                if mismatch_found and stop_on_mismatch:
+                    break
+        finally:
+            chunks.close()
+        return [tuple(r) for r in ranges]
+
+    def verify(self, hexfile, bottom=None, top=None, stop_on_mismatch=False):
+        """Verify the program in the flash matches the hex file."""
 
-        self.erase(bottom, top)
-        self.write(hexfile, bottom, top)
-        self.verify(hexfile, bottom, top)
+        ranges = self.compare(hexfile, bottom, top, stop_on_mismatch)
+        if len(ranges) > 0:
+            MAX_RANGES_SHOWN = 4
+            num_errors = sum([count for (start, end, count) in ranges])
+            range_strs = ['0x%04x-0x%04x (%d)' % (start, end - 1, count) for (start, end, count) in ranges[:MAX_RANGES_SHOWN]]
+            if len(ranges) > MAX_RANGES_SHOWN:
+                range_strs.append('...')
+            raise XsMajorError('%s flash != hex file at %d locations in %d address ranges: %s'
+                                % (self.device_name, num_errors, len(ranges), ', '.join(range_strs)))
+
+    def program(self, hexfile, bottom=None, top=None, incremental=False, retries=2):
+        """Erase, write and verify the flash with the contents of the hex file.
+        
+        The flash is programmed in a single pass: each erase block is erased, written
+        and read back for verification before going on to the next one.
+        
+        incremental = If true, only rewrite the erase blocks that differ from the hex file
+                      and leave the rest of the flash untouched.
+        retries = Number of times to rewrite a block that fails to verify.
+        """
+
+        hexfile = self._to_intel_hex(hexfile)
+        if incremental:
+            if len(hexfile) == 0:
+                return
+            (bottom, top) = self._hex_bounds(hexfile, bottom, top)
+        (bottom, top) = self._set_blk_bounds(bottom, top, self._ERASE_BLK_SZ)
+        self._program_blks(hexfile, bottom, top, incremental, verify=True, retries=retries)
 
         
 _MODULE_ID = 0xf0  # Default module ID for JTAG interface to serial configuration flash.
@@ -151,14 +416,19 @@ class W25X(FlashDevice):
         }
 
     _START_ADDR = 0x00000
+    _ERASE_BLK_SZ = 4096 # Smallest erasable section (sector) of the flash.
+    _BIG_ERASE_BLK_SZ = 65536 # Size of the larger erasable sections (blocks) of the flash.
     _WRITE_BLK_SZ = 256
     _READ_BLK_SZ = 256
+    _READ_CHUNK_SZ = 4096 # Number of bytes fetched by each USB transfer when streaming reads.
     _WORD_SZ = 8
     _BUSY_BIT = 0
     
     _JEDEC_ID_CMD = 0x9f
     _READ_STATUS_CMD = 0x05
     _WRITE_ENABLE_CMD = 0x06
+    _SECTOR_ERASE_CMD = 0x20
+    _BLOCK_ERASE_CMD = 0xd8
     _CHIP_ERASE_CMD = 0xc7
     _PAGE_PROGRAM_CMD = 0x02
     _FAST_READ_CMD = 0x0b
@@ -171,12 +441,12 @@ class W25X(FlashDevice):
         xsjtag=None
         ):
         self._spi = XsSpi(xsjtag=xsjtag, module_id=module_id)
+        self.read_chunk_sz = self._READ_CHUNK_SZ
         mfg_id, jedec_id = self.get_chip_id()
         if mfg_id != self.mfg_id:
             raise XsMajorError('Incorrect manufacturer identifier for the W25X serial flash.')
         self.chip_size = self.get_chip_size(jedec_id)
         self._END_ADDR = self.chip_size // 8
-        self._ERASE_BLK_SZ = self._END_ADDR
         self.device_name = self.device_name_prefix + self.chip_info[jedec_id]['name']
 
     def get_chip_id(self):
@@ -196,35 +466,104 @@ class W25X(FlashDevice):
     def _addr_bytes(self, addr):
         return [addr >> 16 & 0xff, addr >> 8 & 0xff, addr & 0xff]
 
-    def erase_blk(self, addr):
-        self._spi.send(self._WRITE_ENABLE_CMD, stop=True)
-        self._spi.send(self._CHIP_ERASE_CMD, stop=True)
-        self._spi.send(self._READ_STATUS_CMD, stop=False)
+    def _wait_until_done(self):
+        """Poll the flash status (after a read-status command was sent) until the flash is not busy."""
         while(self._is_busy()):
             pass
         self._spi.reset()
+
+    def _erase(self, erase_cmd):
+        """Erase a section of the flash using a complete erase command (with any address bytes)."""
+
+        # Send the write-enable, erase and read-status commands in a single USB transfer.
+        self._spi.send_seq([
+            (self._WRITE_ENABLE_CMD, True),
+            (erase_cmd, True),
+            (self._READ_STATUS_CMD, False),
+            ])
+        self._wait_until_done()
+
+    def erase_chip(self):
+        """Erase the entire flash."""
+        self._erase([self._CHIP_ERASE_CMD])
+
+    def erase_big_blk(self, addr):
+        """Erase the 64 KB block of the flash holding the given address."""
+        self._erase([self._BLOCK_ERASE_CMD] + self._addr_bytes(addr))
+
+    def erase_blk(self, addr):
+        """Erase the 4 KB sector of the flash holding the given address."""
+        self._erase([self._SECTOR_ERASE_CMD] + self._addr_bytes(addr))
+
+    def erase(self, bottom=None, top=None):
+        """Erase a section of the flash.
+        
+        The whole chip is erased with a single command. Otherwise, 64 KB blocks are
+        used wherever they fit in the section and 4 KB sectors erase the rest.
+        """
+
+        (bottom, top) = self._set_blk_bounds(bottom, top, self._ERASE_BLK_SZ)
+        if bottom == self._START_ADDR and top == self._END_ADDR:
+            self.erase_chip()
+            return
+        addr = bottom
+        while addr < top:
+            if addr % self._BIG_ERASE_BLK_SZ == 0 and addr + self._BIG_ERASE_BLK_SZ <= top:
+                self.erase_big_blk(addr)
+                addr += self._BIG_ERASE_BLK_SZ
+            else:
+                self.erase_blk(addr)
+                addr += self._ERASE_BLK_SZ
         
     def write_blk(self, addr, data):
-        self._spi.send(self._WRITE_ENABLE_CMD, stop=True)
-        self._spi.send(self._PAGE_PROGRAM_CMD, stop=False)
-        self._spi.send(self._addr_bytes(addr), stop=False)
-        self._spi.send(data, stop=True)
-        self._spi.send(self._READ_STATUS_CMD, stop=False)
-        while(self._is_busy()):
-            pass
-        self._spi.reset()
+        """Program a page of the flash.
+        
+        The write-enable, page-program command, address and data bytes, and the
+        read-status command that starts the busy polling are all sent in a single
+        USB transfer, so each page costs one transfer plus the polling for the
+        end of the page-program operation.
+        """
+
+        self._spi.send_seq([
+            (self._WRITE_ENABLE_CMD, True),
+            ([self._PAGE_PROGRAM_CMD] + self._addr_bytes(addr) + list(data), True),
+            (self._READ_STATUS_CMD, False),
+            ])
+        self._wait_until_done()
+
+    def _start_read(self, addr):
+        """Send the fast-read command, address and dummy byte that start reading the flash."""
+        self._spi.send_seq([([self._FAST_READ_CMD] + self._addr_bytes(addr) + [0], False)])
+
+    def read_blk(self, addr, num_bytes=0):
+        """Read data from the flash."""
+
+        self._start_read(addr)
+        return self._spi.receive_bytes(num_data=num_bytes, stop=True)
+
+    def _read_chunks(self, bottom, top):
+        """Generate (address, byte array) chunks with the contents of the flash between the bottom and top addresses.
+        
+        A single fast-read command streams through the entire section while the
+        data is fetched in chunks of read_chunk_sz bytes.
+        """
 
-    def read(self, bottom=None, top=None):
+        self._start_read(bottom)
+        try:
+            for addr in range(bottom, top, self.read_chunk_sz):
+                yield (addr, self._spi.receive_bytes(num_data=min(self.read_chunk_sz, top - addr), stop=False))
+        finally:
+            self._spi.reset()
+
+    def read(self, bottom=None, top=None, progress=None):
         """Return the hex data stored in a section of the flash."""
 
-        if bottom > top:
-            raise XsMinorError('Bottom address is greater than the top address.')
-        self._spi.send(self._FAST_READ_CMD, stop=False)
-        self._spi.send(self._addr_bytes(bottom), stop=False)
-        self._spi.send([0], stop=False)
-        data = self._spi.receive(num_data=top-bottom, stop=True)
+        if bottom == None:
+            bottom = self._START_ADDR
+        data = bytearray()
+        self.read_stream(data, bottom, top, progress)
         hex_data = IntelHex()
-        hex_data[bottom:top] = [byte.uint for byte in data]
+        hex_data.puts(bottom, str(data))
         return hex_data
         
 if __name__ == '__main__':
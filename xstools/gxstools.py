@@ -171,7 +171,7 @@ class GxsProgressDialog(wx.ProgressDialog):
             self.close()
 
     def on_progress_change(self, value):
-        self._value = msg
+        self._value = value
         if not self.Update(value=value)[0]:
             self.close()
 
@@ -39,45 +39,114 @@ class Pic18f14k50(FlashDevice):
     _ERASE_BLK_SZ = 64
     _WRITE_BLK_SZ = 16
     _READ_BLK_SZ = 16
+    _READ_CHUNK_SZ = 1024  # Number of bytes gathered by each batch of read commands.
+    _MAX_PENDING_RESPONSE_BYTES = 64  # Most response bytes left unread (one packet of the USB IN endpoint).
 
     def __init__(self, xsusb=None):
         self._xsusb = xsusb
+        self.read_chunk_sz = self._READ_CHUNK_SZ
 
     def _addr_bytes(self, addr):
         return bytearray([addr & 0xff, addr >> 8 & 0xff, addr >> 16 & 0xff])
 
-    def erase_blk(self, addr):
-        """Erase a block of flash in the microcontroller."""
-
+    def _erase_cmd(self, addr):
         num_blocks = 1
         cmd = bytearray([self._xsusb.ERASE_FLASH_CMD, num_blocks])
         cmd.extend(self._addr_bytes(addr))
-        self._xsusb.write(cmd)
-        response = self._xsusb.read(num_bytes=1)
-        if response[0] != cmd[0]:
-            raise XsMajorError("Incorrect command echo in %s." % sys.sys._getframe().f_code.co_name)
-
-    def write_blk(self, addr, data):
-        """Write data to a block of flash in the microcontroller."""
+        return cmd
 
+    def _write_cmd(self, addr, data):
         cmd = bytearray([self._xsusb.WRITE_FLASH_CMD, len(data)])
         cmd.extend(self._addr_bytes(addr))
         cmd.extend(bytearray(data))
-        self._xsusb.write(cmd)
-        response = self._xsusb.read(num_bytes=1)
-        if response[0] != cmd[0]:
-            raise XsMajorError("Incorrect command echo in %s." % sys.sys._getframe().f_code.co_name)
+        return cmd
+
+    def _read_cmd(self, addr, num_bytes):
+        cmd = bytearray([self._xsusb.READ_FLASH_CMD, num_bytes])
+        cmd.extend(self._addr_bytes(addr))
+        return cmd
+
+    def _response_len(self, cmd):
+        """Return the number of bytes the microcontroller sends back in response to a flash command."""
+
+        if cmd[0] == self._xsusb.READ_FLASH_CMD:
+            return 5 + cmd[1]  # Echo of the command header followed by the flash data.
+        return 1  # Echo of the command byte.
+
+    def _run_cmds(self, cmds):
+        """Send a list of flash commands to the microcontroller and return the list of responses.
+        
+        Commands are sent ahead of reading back their responses so the microcontroller doesn't
+        sit idle waiting on a USB turnaround for each one, but only as long as the unread responses
+        fit into _MAX_PENDING_RESPONSE_BYTES so they never need more than a single IN packet.
+        All the responses are collected before any are checked so the USB link stays in
+        sync even if a command fails.
+        """
+
+        responses = []
+        pending_bytes = 0  # Bytes in the responses to commands that have been sent but not read back.
+        for (i, cmd) in enumerate(cmds):
+            # Read back the oldest responses until there's room for the response to this command.
+            while len(responses) < i and pending_bytes + self._response_len(cmd) > self._MAX_PENDING_RESPONSE_BYTES:
+                num_bytes = self._response_len(cmds[len(responses)])
+                responses.append(self._xsusb.read(num_bytes=num_bytes))
+                pending_bytes -= num_bytes
+            self._xsusb.write(cmd)
+            pending_bytes += self._response_len(cmd)
+        for cmd in cmds[len(responses):]:
+            responses.append(self._xsusb.read(num_bytes=self._response_len(cmd)))
+
+        for (cmd, response) in zip(cmds, responses):
+            echo_len = 5 if cmd[0] == self._xsusb.READ_FLASH_CMD else 1
+            if bytearray(response[:echo_len]) != cmd[:echo_len]:
+                addr = cmd[2] | cmd[3] << 8 | cmd[4] << 16
+                raise XsMajorError('Incorrect command echo for block 0x%04x of %s flash.' % (addr, self.device_name))
+        return responses
+
+    def erase_blk(self, addr):
+        """Erase a block of flash in the microcontroller."""
+
+        self._run_cmds([self._erase_cmd(addr)])
+
+    def erase_blks(self, addrs):
+        """Erase a list of flash blocks in the microcontroller."""
+
+        self._run_cmds([self._erase_cmd(addr) for addr in addrs])
+
+    def write_blk(self, addr, data):
+        """Write data to a block of flash in the microcontroller."""
+
+        self._run_cmds([self._write_cmd(addr, data)])
+
+    def write_blks(self, blks):
+        """Write a list of (address, data) blocks to the flash in the microcontroller."""
+
+        self._run_cmds([self._write_cmd(addr, data) for (addr, data) in blks])
+
+    def _rewrite_blk(self, addr, data):
+        """Erase a block of flash and write it with the given data using a single batch of commands."""
+
+        cmds = [self._erase_cmd(addr)]
+        cmds.extend([self._write_cmd(a, d) for (a, d) in self._split_write_blks(addr, data)])
+        self._run_cmds(cmds)
 
     def read_blk(self, addr, num_bytes=0):
         """Read data from the flash in the microcontroller."""
 
-        cmd = bytearray([self._xsusb.READ_FLASH_CMD, num_bytes])
-        cmd.extend(self._addr_bytes(addr))
-        self._xsusb.write(cmd)
-        response = self._xsusb.read(num_bytes=num_bytes + len(cmd))
-        if response[0] != cmd[0]:
-            raise XsMajorError("Incorrect command echo in %s." % sys.sys._getframe().f_code.co_name)
-        return response[5:]
+        return self._run_cmds([self._read_cmd(addr, num_bytes)])[0][5:]
+
+    def _read_chunks(self, bottom, top):
+        """Generate (address, data) chunks of the flash between the bottom and top addresses.
+        Each chunk is gathered with a single batch of read commands.
+        """
+
+        for addr in range(bottom, top, self.read_chunk_sz):
+            end = min(addr + self.read_chunk_sz, top)
+            cmds = [self._read_cmd(a, min(self._READ_BLK_SZ, end - a)) for a in range(addr, end, self._READ_BLK_SZ)]
+            data = bytearray()
+            for response in self._run_cmds(cmds):
+                data.extend(response[5:])
+            yield (addr, data)
 
     def read_eedata(self, addr):
         """Return a byte read from the microcontroller EEDATA."""
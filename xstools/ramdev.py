@@ -25,6 +25,7 @@ Classes for devices containing RAM memory.
 
 import logging
 import struct
+from fractions import gcd
 from intelhex import IntelHex
 from xserror import *
 from xsmemio import *
@@ -45,25 +46,57 @@ class RamDevice:
             raise XsMinorError('Bottom address is greater than the top address.')
         return (bottom, top)
 
-    def erase(self, bottom=None, top=None):
-        """Erase a section of the flash."""
-
-        if bottom is None or top is None:
-            raise XsMinorError('Must specify both top and bottom addresses to erase %s.', self._DEVICE_NAME)
-            
+    def _check_word_bounds(self, bottom, top):
         if bottom % self._WORD_SIZE != 0:
             raise XsMinorError('Bottom address must be a multiple of the %s word size (%x / %d != 0)' % (self._DEVICE_NAME, bottom, self._WORD_SIZE))
         num_bytes = (top-bottom+1)
         if num_bytes % self._WORD_SIZE != 0:
             raise XsMinorError('Number of bytes is not a multiple of the %s word size (%x / %d != 0)' % (self._DEVICE_NAME, num_bytes, self._WORD_SIZE))
-            
-        hex_data = IntelHex()
-        for addr in range(bottom,top+1):
-            hex_data[addr] = 0xff
-        self.write(hex_data)
+        return (bottom/self._WORD_SIZE, num_bytes/self._WORD_SIZE)
+
+    def erase(self, bottom=None, top=None):
+        """Erase a section of the flash."""
+
+        if bottom is None or top is None:
+            raise XsMinorError('Must specify both top and bottom addresses to erase %s.', self._DEVICE_NAME)
+        self.fill(bottom, top, 0xff)
+
+    def fill(self, bottom, top, pattern=0xff):
+        """Fill a section of the RAM with a byte value or a repeating sequence of bytes.
+        
+        pattern = An integer byte value (0-255), or a string, bytearray, list or tuple
+                  of byte values that's repeated starting at the bottom address.
+        
+        The RAM is written in blocks built once from the pattern, so the section is never held in memory.
+        """
+
+        if isinstance(pattern, (int, long)):
+            pattern = [pattern]
+        try:
+            pattern = str(bytearray(pattern))
+        except (TypeError, ValueError):
+            raise XsMinorError('Fill pattern for %s must be a byte value or a sequence of byte values (0-255).' % self._DEVICE_NAME)
+        if len(pattern) == 0:
+            raise XsMinorError('Fill pattern for %s is empty.' % self._DEVICE_NAME)
+        (ram_bottom, num_words) = self._check_word_bounds(bottom, top)
+        
+        # Make each block a whole number of patterns so every block holds the same words.
+        pattern_words = len(pattern) / gcd(len(pattern), self._WORD_SIZE)
+        blk_words = max(self._ram.max_xfer_words // pattern_words, 1) * pattern_words
+        blk_words = min(blk_words, (num_words + pattern_words - 1) // pattern_words * pattern_words)
+        hex_to_word_format = self._WORD_ENDIAN + str(blk_words) + self._WORD_TYPE
+        blk = struct.unpack(hex_to_word_format, pattern * (blk_words * self._WORD_SIZE / len(pattern)))
+        
+        for addr in range(ram_bottom, ram_bottom + num_words, blk_words):
+            n = min(blk_words, ram_bottom + num_words - addr)
+            self._ram.write(addr, blk[:n] if n < blk_words else blk)
 
     def write(self, hexfile, bottom=None, top=None):
-        """Download a hexfile into a section of the RAM."""
+        """Download a hexfile into a section of the RAM.
+        
+        Only the addresses holding hex data are written, so a file with small segments
+        spread across the RAM takes about as long as one with all the data together.
+        """
 
         # If the argument is not already a hex data object, then it must be a file name, so read the hex data from it.
         if not isinstance(hexfile, IntelHex):
@@ -82,22 +115,50 @@ class RamDevice:
         # If min and/or max address is undefined, then hex data must be empty.
         if bottom is None or top is None:
             raise XsMinorError('No data to write.')
-            
-        # Convert the hex data byte-wise addresses into addresses for the word-size of the memory device.
-        if bottom % self._WORD_SIZE != 0:
-            raise XsMinorError('Bottom address must be a multiple of the %s word size (%x / %d != 0)' % (self._DEVICE_NAME, bottom, self._WORD_SIZE))
-        num_bytes = (top-bottom+1)
-        if num_bytes % self._WORD_SIZE != 0:
-            raise XsMinorError('Number of bytes is not a multiple of the %s word size (%x / %d != 0)' % (self._DEVICE_NAME, num_bytes, self._WORD_SIZE))
-        ram_bottom = bottom/self._WORD_SIZE
-        num_words = num_bytes/self._WORD_SIZE
-        
-        # Convert the hex data into words for the RAM.
-        hex_to_word_format = self._WORD_ENDIAN + str(num_words) + self._WORD_TYPE
-        ram_words = struct.unpack(hex_to_word_format, hexfile.gets(bottom,num_bytes))
-        
-        # Write the words to the RAM.
-        self._ram.write(ram_bottom, ram_words)
+
+        # Find the segments of hex data between the bottom and top addresses and expand them
+        # to word boundaries, merging any that end up in the same or adjacent words.
+        spans = []  # [first byte address, last byte address + 1, list of (start, end) data segments]
+        for (start, end) in hexfile.segments():
+            (start, end) = (max(start, bottom), min(end, top + 1))
+            if start >= end:
+                continue
+            (span_start, span_end) = (start - start % self._WORD_SIZE, end + (-end) % self._WORD_SIZE)
+            if len(spans) > 0 and span_start <= spans[-1][1]:
+                spans[-1][1] = span_end
+                spans[-1][2].append((start, end))
+            else:
+                spans.append([span_start, span_end, [(start, end)]])
+        if len(spans) == 0:
+            raise XsMinorError('No data to write.')
+
+        # Words that are only partially covered by the hex data are read from the RAM
+        # so the bytes outside the hex data keep their current values.
+        partial_words = set()
+        for (span_start, span_end, segments) in spans:
+            gap_start = span_start
+            for (start, end) in segments + [(span_end, span_end)]:
+                partial_words.update(range(gap_start / self._WORD_SIZE, (start + self._WORD_SIZE - 1) / self._WORD_SIZE))
+                gap_start = end
+        partial_words = sorted(partial_words)
+        partial_data = self._ram.read_many([(addr, 1) for addr in partial_words], return_type=int()) if partial_words else []
+        word_format = self._WORD_ENDIAN + self._WORD_TYPE
+        partial_bytes = dict((addr, struct.pack(word_format, data[0])) for (addr, data) in zip(partial_words, partial_data))
+
+        # Convert each span of hex data into words and write them all to the RAM as one batch.
+        writes = []
+        for (span_start, span_end, segments) in spans:
+            span_bytes = bytearray(span_end - span_start)
+            for addr in range(span_start / self._WORD_SIZE, span_end / self._WORD_SIZE):
+                if addr in partial_bytes:
+                    offset = addr * self._WORD_SIZE - span_start
+                    span_bytes[offset:offset + self._WORD_SIZE] = partial_bytes[addr]
+            for (start, end) in segments:
+                span_bytes[start - span_start:end - span_start] = hexfile.gets(start, end - start)
+            num_words = len(span_bytes) / self._WORD_SIZE
+            hex_to_word_format = self._WORD_ENDIAN + str(num_words) + self._WORD_TYPE
+            writes.append((span_start / self._WORD_SIZE, struct.unpack(hex_to_word_format, str(span_bytes))))
+        self._ram.write_many(writes)
 
     def read(self, bottom=None, top=None):
         """Return the hex data stored in a section of the RAM."""
@@ -105,13 +166,7 @@ class RamDevice:
         if bottom is None or top is None:
             raise XsMinorError('Must specify both top and bottom addresses to read %s.', self._DEVICE_NAME)
             
-        if bottom % self._WORD_SIZE != 0:
-            raise XsMinorError('Bottom address must be a multiple of the %s word size (%x / %d != 0)' % (self._DEVICE_NAME, bottom, self._WORD_SIZE))
-        num_bytes = (top-bottom+1)
-        if num_bytes % self._WORD_SIZE != 0:
-            raise XsMinorError('Number of bytes is not a multiple of the %s word size (%x / %d != 0)' % (self._DEVICE_NAME, num_bytes, self._WORD_SIZE))
-        ram_bottom = bottom/self._WORD_SIZE
-        num_words = num_bytes/self._WORD_SIZE
+        (ram_bottom, num_words) = self._check_word_bounds(bottom, top)
         
         ram_words = self._ram.read(ram_bottom, num_words, return_type=int())
         word_to_hex_format = self._WORD_ENDIAN + str(num_words) + self._WORD_TYPE
@@ -28,6 +28,7 @@ import logging
 import time
 from xserror import *
 from xsjtag import *
+from xshostio import XsHostIoSession
 from xilbitstr import *
 
 
@@ -56,7 +57,19 @@ class XilinxFpga:
         if not self.is_connected():
             raise XsMinorError("FPGA IDCODE %s doesn't match the expected value %s." % (self.get_idcode(), self._IDCODE))
 
-        self.download_bitstream(bitstream)
+        # Any parameters remembered for the HostIo modules in the old design are no longer valid.
+        XsHostIoSession.get(self.xsjtag).invalidate()
+
+        if self.xsjtag.can_disable_return():
+            # The download is write-only, so stream it without waiting for command responses.
+            self.xsjtag.disable_return()
+            try:
+                self.download_bitstream(bitstream)
+            finally:
+                self.xsjtag.enable_return()
+        else:
+            # Older firmware always responds, so each response is checked as the download proceeds.
+            self.download_bitstream(bitstream)
 
         # Check to see if configuration was successful.
         if self.get_status()['DONE'] != True:
@@ -339,7 +352,7 @@ class Xc6s(XilinxFpga):
         """Perform the detailed steps for downloading a bitstream to this FPGA device type."""
 
         self.xsjtag.reset_tap()
-        self.xsjtag.go_thru_tap_states('Run-Test/Idle')
+        self.xsjtag.goto_state('Run-Test/Idle')
         self.xsjtag.load_ir_then_dr(instruction=self._JPROGRAM_INSTR)
         self.xsjtag.load_ir_then_dr(instruction=self._CFG_IN_INSTR)
 
@@ -25,6 +25,7 @@ XESS extensions to the BitArray class of the bitstring module.
 """
 
 import logging
+import binascii
 from xserror import *
 import bitstring
 from bitstring import Bits, BitArray, BitStream, ConstBitStream
@@ -53,11 +54,15 @@ class XsBitArray(BitArray):
     def append(self, bits):
         """Append the contents of a bitstring to this one, but in reverse order."""
 
+        if isinstance(bits, XsBitVec):
+            bits = bits.to_bitarray()
         return super(XsBitArray, self).prepend(bits)
 
     def prepend(self, bits):
         """Prepend the contents of a bitstring to this one, but in reverse order."""
 
+        if isinstance(bits, XsBitVec):
+            bits = bits.to_bitarray()
         return super(XsBitArray, self).append(bits)
 
     def __add__(self, bits):
@@ -80,6 +85,16 @@ class XsBitArray(BitArray):
         self = self + bits
         return self
 
+    def __eq__(self, bits):
+        """Compare bitstrings. An XsBitVec does the comparison so the result is the same both ways."""
+
+        if isinstance(bits, XsBitVec):
+            return bits.__eq__(self)
+        return super(XsBitArray, self).__eq__(bits)
+
+    def __ne__(self, bits):
+        return not self.__eq__(bits)
+
     def head(self, length=1):
         """Return the first set of transmitted or received bits from a bitstring."""
 
@@ -147,6 +162,279 @@ class XsBitArray(BitArray):
         return getattr(super(XsBitArray, self), name)
 
 
+class XsBitVec(object):
+
+    """Compact bit vector with the same reversed-concatenation behavior as XsBitArray.
+    
+    The bits are held in a Python integer with the first transmitted bit in the
+    least-significant position, so the integer is also the unsigned value of the vector.
+    Concatenating, splitting and converting to/from USB bytes are done with integer
+    shifts and masks instead of creating new bitstring objects.
+    """
+
+    __slots__ = ('_value', '_len')
+
+    def __init__(self, auto=None, length=None, uint=None, bytes=None, bin=None, hex=None):
+        """Create a bit vector.
+        
+        auto = Number of zero bits, a '0b...' or '0x...' string, a list of bits (index 0 is
+               the last bit transmitted, as with XsBitArray), or an XsBitArray or XsBitVec.
+        length = Number of bits when the value is given by uint or bytes.
+        uint = Unsigned value of the vector.
+        bytes = Byte string with the last transmitted bits in the first byte (as with XsBitArray).
+        bin, hex = Binary or hexadecimal string with the last transmitted bit first.
+        """
+
+        if uint != None:
+            (self._value, self._len) = (uint, length)
+        elif bytes != None:
+            self._len = len(bytes) * 8 if length == None else length
+            self._value = int(binascii.hexlify(bytes[:(self._len + 7) // 8]) or '0', 16) >> ((8 - self._len % 8) % 8)
+        elif bin != None:
+            (self._value, self._len) = (int(bin or '0', 2), len(bin))
+        elif hex != None:
+            (self._value, self._len) = (int(hex or '0', 16), len(hex) * 4)
+        elif auto == None:
+            (self._value, self._len) = (0, 0)
+        elif isinstance(auto, XsBitVec):
+            (self._value, self._len) = (auto._value, auto._len)
+        elif isinstance(auto, Bits):
+            (self._value, self._len) = (auto.uint if auto.len > 0 else 0, auto.len)
+        elif isinstance(auto, (int, long)):
+            (self._value, self._len) = (0, auto)
+        elif isinstance(auto, str):
+            if auto.startswith('0b'):
+                (self._value, self._len) = (int(auto[2:] or '0', 2), len(auto) - 2)
+            elif auto.startswith('0x'):
+                (self._value, self._len) = (int(auto[2:] or '0', 16), (len(auto) - 2) * 4)
+            else:
+                raise XsMinorError('Unable to create a bit vector from %s.' % auto)
+        else:
+            bits = list(auto)
+            (self._value, self._len) = (0, len(bits))
+            for bit in bits:
+                self._value = self._value << 1 | (1 if bit else 0)
+        if self._value >> self._len:
+            raise XsMinorError('Value 0x%x does not fit into %d bits.' % (self._value, self._len))
+
+    @staticmethod
+    def _make(value, length):
+        """Create a bit vector directly from its integer value and length."""
+
+        v = XsBitVec.__new__(XsBitVec)
+        v._value = value
+        v._len = length
+        return v
+
+    @staticmethod
+    def _coerce(bits):
+        """Return the integer value and length of a bit vector, bitstring or list of bits."""
+
+        if isinstance(bits, XsBitVec):
+            return (bits._value, bits._len)
+        v = XsBitVec(bits)
+        return (v._value, v._len)
+
+    @property
+    def len(self):
+        return self._len
+
+    @property
+    def uint(self):
+        return self._value
+
+    unsigned = uint
+
+    @property
+    def int(self):
+        if self._len > 0 and self._value >> (self._len - 1):
+            return self._value - (1 << self._len)  # Two's-complement negative number.
+        return self._value
+
+    integer = int
+
+    @property
+    def bin(self):
+        return format(self._value, '0%db' % self._len) if self._len > 0 else ''
+
+    string = bin
+
+    def __len__(self):
+        return self._len
+
+    def __eq__(self, bits):
+        try:
+            return (self._value, self._len) == self._coerce(bits)
+        except (TypeError, XsMinorError):
+            return False
+
+    def __ne__(self, bits):
+        return not self.__eq__(bits)
+
+    def __repr__(self):
+        return "XsBitVec('0b%s')" % self.bin
+
+    def __str__(self):
+        return '0b' + self.bin
+
+    def __add__(self, bits):
+        """Concatenate two bit vectors with the bits of this one transmitted first."""
+
+        (value, length) = self._coerce(bits)
+        return XsBitVec._make(self._value | value << self._len, self._len + length)
+
+    def __radd__(self, bits):
+        """Concatenate two bit vectors with the bits of the other one transmitted first."""
+
+        (value, length) = self._coerce(bits)
+        return XsBitVec._make(value | self._value << length, self._len + length)
+
+    def __iadd__(self, bits):
+        """Append the bits of another bit vector to be transmitted after the bits of this one."""
+
+        (value, length) = self._coerce(bits)
+        self._value |= value << self._len
+        self._len += length
+        return self
+
+    def __getitem__(self, key):
+        """Return a bit or a slice of bits using the same indexing as XsBitArray (index 0 is the last bit transmitted)."""
+
+        if isinstance(key, slice):
+            (start, stop, step) = key.indices(self._len)
+            if step != 1:
+                raise XsMinorError('Bit vector slices must be contiguous.')
+            length = max(stop - start, 0)
+            return XsBitVec._make(self._value >> (self._len - start - length) & ((1 << length) - 1), length)
+        if key < 0:
+            key += self._len
+        if key < 0 or key >= self._len:
+            raise IndexError('Bit index %d out of range.' % key)
+        return bool(self._value >> (self._len - 1 - key) & 1)
+
+    def head(self, length=1):
+        """Return the first set of transmitted or received bits."""
+
+        return XsBitVec._make(self._value & ((1 << length) - 1), length)
+
+    def tail(self, length=1):
+        """Return the last set of transmitted or received bits."""
+
+        return XsBitVec._make(self._value >> (self._len - length), length)
+
+    def pop_field(self, length):
+        """Remove the first set of transmitted or received bits and return it."""
+
+        field = self.head(length)
+        self._value >>= length
+        self._len -= length
+        return field
+
+    def any(self, value):
+        """Return True if any bit in the vector equals the given value."""
+
+        if value:
+            return self._value != 0
+        return self._value != (1 << self._len) - 1
+
+    def to_usb(self):
+        """Return a byte string with the first bit to transmit in the least-significant bit of the first byte."""
+
+        num_bytes = (self._len + 7) // 8
+        if num_bytes == 0:
+            return ''
+        return binascii.unhexlify('%0*x' % (num_bytes * 2, self._value))[::-1]
+
+    @staticmethod
+    def from_usb(usb_bytes, length=0):
+        """Create a bit vector from the first length bits of a byte array received over USB."""
+
+        value = int(binascii.hexlify(str(bytearray(usb_bytes)[::-1])) or '0', 16)
+        return XsBitVec._make(value & ((1 << length) - 1), length)
+
+    def to_bitarray(self):
+        """Return an XsBitArray with the same bits."""
+
+        if self._len == 0:
+            return XsBitArray()
+        return XsBitArray(uint=self._value, length=self._len)
+
+
+class XsBitReader(object):
+
+    """Reader that walks the fields of a received bit array without modifying it.
+    
+    Fields are read in the order their bits were received, just as pop_field() would
+    return them, but the source bit array is left intact and each field costs only
+    as much as the field itself.
+    """
+
+    __slots__ = ('_bits', '_value', '_len', 'pos')
+
+    def __init__(self, bits):
+        """Start reading at the first received bit of an XsBitArray or XsBitVec."""
+
+        self._bits = bits
+        self._len = bits.len
+        self._value = bits.uint if bits.len > 0 else 0  # First received bit is the least-significant bit.
+        self.pos = 0  # Number of bits already read.
+
+    def remaining(self):
+        """Return the number of bits left to read."""
+
+        return self._len - self.pos
+
+    def _advance(self, length):
+        if length > self._len - self.pos:
+            raise XsMinorError('Attempt to read %d bits with only %d left.' % (length, self._len - self.pos))
+        start = self.pos
+        self.pos += length
+        return start
+
+    def skip(self, length):
+        """Skip over a field."""
+
+        self._advance(length)
+
+    def read_uint(self, length):
+        """Return the next field as an unsigned integer."""
+
+        return self._value >> self._advance(length) & ((1 << length) - 1)
+
+    def read_int(self, length):
+        """Return the next field as a two's-complement signed integer."""
+
+        value = self.read_uint(length)
+        if length > 0 and value >> (length - 1):
+            value -= 1 << length
+        return value
+
+    def read(self, length):
+        """Return the next field as a bit array of the same type as the source."""
+
+        start = self._advance(length)
+        return self._bits[self._len - start - length:self._len - start]
+
+
+def _benchmark(bit_class, num_iterations=2000):
+    """Time a typical HostIo transaction built and decoded with the given bit vector class."""
+
+    import time
+    start = time.time()
+    for i in range(num_iterations):
+        # Build a transaction: module ID, bit count, opcode, address and data words.
+        tdi = bit_class(uint=0xff, length=8) + bit_class(uint=100, length=32) + bit_class('0b11')
+        tdi += bit_class(uint=i, length=24)
+        for j in range(16):
+            tdi += bit_class(uint=j, length=16)
+        usb_bytes = tdi.to_usb()
+        # Decode a result: a bunch of fields popped off the front.
+        tdo = bit_class.from_usb(usb_bytes, tdi.len)
+        for j in range(tdi.len // 16):
+            tdo.pop_field(16).uint
+    return time.time() - start
+
+
 if __name__ == '__main__':
     logging.root.setLevel(logging.DEBUG)
     a = XsBitArray('0b00010')
@@ -154,3 +442,12 @@ if __name__ == '__main__':
     c = a + b
     print a, b, c
     print repr(c.to_usb())
+
+    # Check the compact bit vector matches the bitstring-based one and compare their speed.
+    d = XsBitVec(a) + XsBitVec(b)
+    assert d == c and d.to_usb() == c.to_usb()
+    assert XsBitVec.from_usb(c.to_usb(), c.len) == XsBitArray.from_usb(c.to_usb(), c.len)
+    assert d.head(6) == c.head(6) and d.tail(3) == c.tail(3)
+    t_array = _benchmark(XsBitArray)
+    t_vec = _benchmark(XsBitVec)
+    print 'XsBitArray: %.3fs  XsBitVec: %.3fs  (%.1fx faster)' % (t_array, t_vec, t_array / t_vec)
@@ -24,6 +24,8 @@ Classes for types of XESS FPGA boards.
 """
 
 import time
+import logging
+import usb.core
 import xstools
 from pubsub import pub as PUBSUB
 from xserror import *
@@ -32,6 +34,7 @@ from xsdutio import *
 from flashdev import *
 from ramdev import *
 from picmicro import *
+from xstune import *
 
 class XsBoard:
 
@@ -73,6 +76,9 @@ class XulaMicro(XsBoard):
         self.xsjtag = XsJtag(self.xsusb)
         # Instantiate microcontroller. (Override this in subclass if a different uC is used.)
         self.micro = Pic18f14k50(xsusb=self.xsusb)
+        # Use the transfer sizes found by tune_xfer_sizes() if it was ever run for this board.
+        self.xfer_sizes = load_xfer_sizes(self._get_xfer_sizes_key())
+        self.micro.read_chunk_sz = self.xfer_sizes.get('micro_read', self.micro.read_chunk_sz)
 
     def reset(self):
         """Reset the XESS board."""
@@ -125,14 +131,71 @@ class XulaMicro(XsBoard):
         
         return self.xsusb.get_xsusb_id()
 
-    def update_firmware(self, hexfile=None):
-        """Re-flash microcontroller with new firmware from hex file."""
+    def _get_xfer_sizes_key(self):
+        """Return the key for this board in the file of tuned transfer sizes."""
+
+        return '%s@%s' % (self.name, self.xsusb.get_location())
+
+    def tune_xfer_sizes(self):
+        """Find the transfer sizes that give the best throughput with this board and save them."""
+
+        self.xfer_sizes.update(self._tune_xfer_sizes())
+        save_xfer_sizes(self._get_xfer_sizes_key(), self.xfer_sizes)
+        PUBSUB.sendMessage("Progress.Phase", phase="Transfer size tuning done")
+        return dict(self.xfer_sizes)
+
+    def _tune_xfer_sizes(self):
+        """Return a dictionary with the best transfer size for each bulk operation on the board."""
+
+        NUM_BYTES = 8192  # Amount of microcontroller flash read for each transfer size.
+        
+        PUBSUB.sendMessage("Progress.Phase", phase="Tuning microcontroller transfer sizes")
+        def read_micro(size):
+            self.micro.read_chunk_sz = size
+            self.micro.read_stream(bytearray(), self.micro._START_ADDR, self.micro._START_ADDR + NUM_BYTES)
+        xfer_sizes = {}
+        # The microcontroller flash can only be read in reflash mode.
+        self.micro.enter_reflash_mode()
+        try:
+            xfer_sizes['micro_read'] = tune_xfer_size(read_micro, [256, 512, 1024, 2048, 4096], NUM_BYTES)
+        finally:
+            self.micro.enter_user_mode()
+        self.micro.read_chunk_sz = xfer_sizes['micro_read']
+        return xfer_sizes
+
+    def _report_progress(self, num_done, num_total):
+        """Publish the percentage of a long-running operation that's been completed."""
+
+        PUBSUB.sendMessage("Progress.Pct", value=num_done * 100 // max(num_total, 1))
+
+    def update_firmware(self, hexfile=None, incremental=False):
+        """Re-flash microcontroller with new firmware from hex file.
+        
+        incremental = If true, compare the current firmware to the hex file first and
+                      only rewrite the flash blocks that differ. Nothing is rewritten
+                      if the firmware already matches.
+        """
 
         PUBSUB.sendMessage("Progress.Phase", phase="Updating firmware")
         if hexfile == None:
             hexfile = self.firmware
+        # The microcontroller flash can only be read in reflash mode.
         self.micro.enter_reflash_mode()
-        self.micro.program(hexfile)
+        if incremental:
+            try:
+                mismatches = self.micro.compare(hexfile)
+            except (XsError, usb.core.USBError):
+                # The flash couldn't be read, so restart the USB connection to discard any
+                # responses that were left unread and then rewrite all the firmware.
+                logging.debug('Unable to compare firmware. Rewriting all of it.')
+                self.xsusb.reset()
+                incremental = False
+                mismatches = None
+            if mismatches == []:
+                self.micro.enter_user_mode()
+                PUBSUB.sendMessage("Progress.Phase", phase="Firmware already up to date")
+                return
+        self.micro.program(hexfile, incremental=incremental)
         self.micro.enter_user_mode()
         self.micro.disable_jtag_cable() # uC flash sometimes enables auxiliary JTAG cable, so make sure it's disabled.
         PUBSUB.sendMessage("Progress.Phase", phase="Firmware update done")
@@ -239,38 +302,83 @@ class XulaBase(XulaMicro):
                     return # Test passed!
             prev_progress = progress.unsigned
         
+    def _make_cfg_flash(self):
+        """Create the serial configuration flash and set its transfer size."""
+
+        cfg_flash = self.create_cfg_flash()
+        cfg_flash.read_chunk_sz = self.xfer_sizes.get('cfg_flash_read', cfg_flash.read_chunk_sz)
+        return cfg_flash
+
+    def _make_sdram(self):
+        """Create the SDRAM and set its transfer size."""
+
+        sdram = self.create_sdram()
+        sdram._ram.max_xfer_words = self.xfer_sizes.get('sdram_xfer_words', sdram._ram.max_xfer_words)
+        return sdram
+
+    def _tune_xfer_sizes(self):
+        """Return a dictionary with the best transfer size for each bulk operation on the board."""
+
+        FLASH_NUM_BYTES = 65536  # Amount of configuration flash read for each transfer size.
+        SDRAM_NUM_WORDS = 65536  # Number of SDRAM words read for each transfer size.
+
+        xfer_sizes = XulaMicro._tune_xfer_sizes(self)
+
+        PUBSUB.sendMessage("Progress.Phase", phase="Tuning configuration flash transfer sizes")
+        self.configure(self.cfg_flash_bitstream, silent=True)
+        self.cfg_flash = self._make_cfg_flash()
+        def read_cfg_flash(size):
+            self.cfg_flash.read_chunk_sz = size
+            self.cfg_flash.read_stream(bytearray(), 0, FLASH_NUM_BYTES)
+        xfer_sizes['cfg_flash_read'] = tune_xfer_size(read_cfg_flash, [256, 1024, 4096, 16384, 65536], FLASH_NUM_BYTES)
+
+        PUBSUB.sendMessage("Progress.Phase", phase="Tuning SDRAM transfer sizes")
+        self.configure(self.sdram_bitstream, silent=True)
+        self.sdram = self._make_sdram()
+        def read_sdram(size):
+            self.sdram._ram.max_xfer_words = size
+            self.sdram._ram.read(0, SDRAM_NUM_WORDS, return_type=int())
+        xfer_sizes['sdram_xfer_words'] = tune_xfer_size(read_sdram, [256, 1024, 4096, 16384, 65536],
+                                                        SDRAM_NUM_WORDS * self.sdram._WORD_SIZE)
+        return xfer_sizes
+
     def read_cfg_flash(self, bottom, top):
         PUBSUB.sendMessage("Progress.Phase", phase="Configuring FPGA for reading configuration flash")
         self.configure(self.cfg_flash_bitstream, silent=True)
         PUBSUB.sendMessage("Progress.Phase", phase="Reading configuration flash")
-        self.cfg_flash = self.create_cfg_flash()
-        hex_data = self.cfg_flash.read(bottom, top)
+        self.cfg_flash = self._make_cfg_flash()
+        hex_data = self.cfg_flash.read(bottom, top, progress=self._report_progress)
         PUBSUB.sendMessage("Progress.Phase", phase="Configuration flash read done")
         return hex_data
         
-    def write_cfg_flash(self, hexfile, bottom=None, top=None):
+    def write_cfg_flash(self, hexfile, bottom=None, top=None, incremental=False):
         PUBSUB.sendMessage("Progress.Phase", phase="Configuring FPGA for writing configuration flash")
         self.configure(self.cfg_flash_bitstream, silent=True)
-        PUBSUB.sendMessage("Progress.Phase", phase="Erasing configuration flash")
-        self.cfg_flash = self.create_cfg_flash()
-        self.cfg_flash.erase()
-        PUBSUB.sendMessage("Progress.Phase", phase="Writing configuration flash")
-        self.cfg_flash.write(hexfile, bottom, top)
+        self.cfg_flash = self._make_cfg_flash()
+        if incremental:
+            # Only rewrite the sections of the flash that differ from the hex file.
+            PUBSUB.sendMessage("Progress.Phase", phase="Updating configuration flash")
+            self.cfg_flash.update(hexfile, bottom, top)
+        else:
+            PUBSUB.sendMessage("Progress.Phase", phase="Erasing configuration flash")
+            self.cfg_flash.erase()
+            PUBSUB.sendMessage("Progress.Phase", phase="Writing configuration flash")
+            self.cfg_flash.write(hexfile, bottom, top)
         PUBSUB.sendMessage("Progress.Phase", phase="Configuration flash write done")
         
     def erase_cfg_flash(self, bottom, top):
         PUBSUB.sendMessage("Progress.Phase", phase="Configuring FPGA for erasing configuration flash")
         self.configure(self.cfg_flash_bitstream, silent=True)
         PUBSUB.sendMessage("Progress.Phase", phase="Erasing configuration flash")
-        self.cfg_flash = self.create_cfg_flash()
-        self.cfg_flash.erase()
+        self.cfg_flash = self._make_cfg_flash()
+        self.cfg_flash.erase(bottom, top)
         PUBSUB.sendMessage("Progress.Phase", phase="Configuration flash erase done")
         
     def read_sdram(self, bottom, top):
         PUBSUB.sendMessage("Progress.Phase", phase="Configuring FPGA for reading SDRAM")
         self.configure(self.sdram_bitstream, silent=True)
         PUBSUB.sendMessage("Progress.Phase", phase="Reading SDRAM")
-        self.sdram = self.create_sdram()
+        self.sdram = self._make_sdram()
         hex_data = self.sdram.read(bottom, top)
         PUBSUB.sendMessage("Progress.Phase", phase="SDRAM read done")
         return hex_data
@@ -279,7 +387,7 @@ class XulaBase(XulaMicro):
         PUBSUB.sendMessage("Progress.Phase", phase="Configuring FPGA for writing SDRAM")
         self.configure(self.sdram_bitstream, silent=True)
         PUBSUB.sendMessage("Progress.Phase", phase="Writing SDRAM")
-        self.sdram = self.create_sdram()
+        self.sdram = self._make_sdram()
         self.sdram.write(hexfile, bottom, top)
         PUBSUB.sendMessage("Progress.Phase", phase="SDRAM write done")
         
@@ -287,7 +395,7 @@ class XulaBase(XulaMicro):
         PUBSUB.sendMessage("Progress.Phase", phase="Configuring FPGA for erasing SDRAM")
         self.configure(self.sdram_bitstream, silent=True)
         PUBSUB.sendMessage("Progress.Phase", phase="Erasing SDRAM")
-        self.sdram = self.create_sdram()
+        self.sdram = self._make_sdram()
         hex_data = self.sdram.erase(bottom, top)
         PUBSUB.sendMessage("Progress.Phase", phase="SDRAM erase done")
         return
@@ -315,10 +423,10 @@ class Xula(XulaBase):
         self.micro.set_cfg_flash_flag(cfg_flash_flag)
         return data
         
-    def write_cfg_flash(self, hexfile, bottom=None, top=None):
+    def write_cfg_flash(self, hexfile, bottom=None, top=None, incremental=False):
         cfg_flash_flag = self.micro.get_cfg_flash_flag()
         self.micro.enable_cfg_flash()
-        XulaBase.write_cfg_flash(self, hexfile, bottom, top)
+        XulaBase.write_cfg_flash(self, hexfile, bottom, top, incremental)
         self.micro.set_cfg_flash_flag(cfg_flash_flag)
         
     def erase_cfg_flash(self, bottom=None, top=None):
@@ -326,6 +434,13 @@ class Xula(XulaBase):
         self.micro.enable_cfg_flash()
         XulaBase.erase_cfg_flash(self, bottom, top)
         self.micro.set_cfg_flash_flag(cfg_flash_flag)
+
+    def _tune_xfer_sizes(self):
+        cfg_flash_flag = self.micro.get_cfg_flash_flag()
+        self.micro.enable_cfg_flash()
+        xfer_sizes = XulaBase._tune_xfer_sizes(self)
+        self.micro.set_cfg_flash_flag(cfg_flash_flag)
+        return xfer_sizes
         
     def create_sdram(self):
         """Create the SDRAM for this board."""
@@ -58,7 +58,7 @@ class XsDutIo(XsHostIo):
         # Setup the super-class object.
         XsHostIo.__init__(self, xsusb_id=xsusb_id, module_id=module_id, xsjtag=xsjtag)
         # Get the number of inputs and outputs of the DUT.
-        (self.total_dut_input_width, self.total_dut_output_width) = self._get_io_widths()
+        (self.total_dut_input_width, self.total_dut_output_width) = self._get_params('io_widths', self._get_io_widths)
         logging.debug('# DUT input bits = %d' % self.total_dut_input_width)
         logging.debug('# DUT output bits = %d' % self.total_dut_output_width)
         assert self.total_dut_output_width != 0
@@ -113,13 +113,14 @@ class XsDutIo(XsHostIo):
         # Send the opcode and then read back the bits with the DUT's #inputs and #outputs.
         params = self.send_rcv(payload=self._SIZE_OPCODE,
                                num_result_bits=self._SIZE_RESULT_LENGTH + SKIP_CYCLES)
-        params.pop_field(SKIP_CYCLES)  # Remove the skipped cycles.
+        reader = XsBitReader(params)
+        reader.skip(SKIP_CYCLES)  # Skip the skipped cycles.
 
         # The number of DUT inputs is in the first half of the bit array.
-        total_dut_input_width = params.pop_field(self._SIZE_RESULT_LENGTH / 2).unsigned
+        total_dut_input_width = reader.read_uint(self._SIZE_RESULT_LENGTH / 2)
 
         # The number of DUT outputs is in the last half of the bit array.
-        total_dut_output_width = params.pop_field(self._SIZE_RESULT_LENGTH / 2).unsigned
+        total_dut_output_width = reader.read_uint(self._SIZE_RESULT_LENGTH / 2)
         return (total_dut_input_width, total_dut_output_width)
 
     def read(self):
@@ -130,18 +131,19 @@ class XsDutIo(XsHostIo):
         # Send the READ_OPCODE and then read back the bits with the DUT's output values.
         result = self.send_rcv(payload=self._READ_OPCODE,
                                num_result_bits=self.total_dut_output_width + SKIP_CYCLES)
-        result.pop_field(SKIP_CYCLES)  # Remove the skipped cycles.
-        assert result.len == self.total_dut_output_width
+        reader = XsBitReader(result)
+        reader.skip(SKIP_CYCLES)  # Skip the skipped cycles.
+        assert reader.remaining() == self.total_dut_output_width
         logging.debug('Read result = ' + repr(result))
 
         if len(self._dut_output_widths) == 1:
             # Return the result bit array if there's only a single output field.
-            return result
+            return reader.read(self.total_dut_output_width)
         else:
             # Otherwise, partition the result bit array into the given output field widths.
             outputs = []
             for w in self._dut_output_widths:
-                outputs.append(result.pop_field(w))
+                outputs.append(reader.read(w))
             return outputs
 
     Read = read  # Associate the old Read() method with the new read() method.
@@ -25,12 +25,95 @@ Base object for performing USB I/O between XESS board and host PC.
 """
 
 import logging
+import struct
+import weakref
 from xsjtag import *
 
 DEFAULT_XSUSB_ID = 0
 DEFAULT_MODULE_ID = 255
 
 
+class XsHostIoSession:
+
+    """State shared by all the HostIo modules that talk through the same JTAG port of a board.
+    
+    The session keeps track of the USER instruction that's loaded into the FPGA's JTAG IR
+    so it isn't reloaded for every module object, and it remembers the parameters
+    (such as address and data widths) that each module reports so they're only fetched once.
+    The module parameters are discarded whenever the FPGA is reconfigured.
+    """
+
+    _sessions = weakref.WeakKeyDictionary()  # Session for each XsJtag object.
+
+    def __init__(self, xsjtag):
+        """Create a session for the given XsJtag object."""
+
+        self.xsjtag = xsjtag
+        self._module_params = {}
+
+    @classmethod
+    def get(cls, xsjtag):
+        """Return the session for an XsJtag object, creating it if needed."""
+
+        try:
+            return cls._sessions[xsjtag]
+        except KeyError:
+            session = cls(xsjtag)
+            cls._sessions[xsjtag] = session
+            return session
+
+    def select(self, user_instr, force=False):
+        """Load a USER instruction into the JTAG IR and go to the shift-dr state for HostIo transactions.
+        
+        user_instr = USER instruction for the modules to be accessed.
+        force = True to reload the instruction even if it's already active.
+        """
+
+        instr = self.xsjtag.instr
+        if not force and self.xsjtag._tap_state == 'Shift-DR' and instr is not None and instr == user_instr:
+            return  # The instruction is already active and transactions can proceed.
+
+        self.xsjtag.reset_tap()  # Reset TAP FSM to test-logic-reset state.
+
+        # Send TAP FSM to the shift-ir state.
+        self.xsjtag.goto_state('Shift-IR')
+
+        # Now enter the USER JTAG instruction into the IR and go to the exit1-ir state.
+        self.xsjtag.shift_tdi(tdi=user_instr, do_exit_shift=True)
+
+        # USER instruction is now active, so transfer to the shift-dr state where data transfers will occur.
+        self.xsjtag.goto_state('Shift-DR')
+        self.xsjtag.flush()
+        self.xsjtag.instr = XsBitArray(user_instr)
+
+    def get_module_params(self, user_instr, module_id, kind, fetch):
+        """Return the parameters reported by a module, fetching them only if they aren't already known.
+        
+        user_instr = USER instruction for the module.
+        module_id = Module ID bit array.
+        kind = Name for the kind of parameters (e.g., 'mem_widths').
+        fetch = Function that gets the parameters from the module.
+        """
+
+        return self.get_params((user_instr.bin, module_id.bin, kind), fetch)
+
+    def get_params(self, key, fetch):
+        """Return the parameters stored under a key, calling fetch to get them if they aren't already known."""
+
+        try:
+            return self._module_params[key]
+        except KeyError:
+            params = fetch()
+            self._module_params[key] = params
+            return params
+
+    def invalidate(self):
+        """Forget the module parameters (e.g., because the FPGA was reconfigured)."""
+
+        self._module_params.clear()
+        self.xsjtag.instr = None
+
+
 class XsHostIo:
 
     """Base object for performing USB I/O between XESS board and host PC."""
@@ -38,6 +121,12 @@ class XsHostIo:
     USER1_INSTR = XsBitArray('0b000010')
     USER2_INSTR = XsBitArray('0b000011')
 
+    _MAX_PENDING_BYTES = 128  # Result bytes the board can hold while the host isn't reading them.
+
+    # Every type of module returns its widths in response to this opcode.
+    _SIZE_OPCODE  = XsBitArray('0b01')
+    _SIZE_RESULT_LENGTH = 16  # Length of _SIZE_OPCODE result.
+
     def __init__(
         self,
         xsusb_id=DEFAULT_XSUSB_ID,
@@ -51,54 +140,200 @@ class XsHostIo:
             self.module_id = XsBitArray(uint=module_id, length=8)
         else:
             self.module_id = XsBitArray(module_id)
+        # Pre-encode the module ID and a slot for the 32-bit bit count into a
+        # byte array that's in USB order (only possible if the module ID fills whole bytes).
+        if self.module_id.len % 8 == 0:
+            self._tdi_hdr = bytearray(self.module_id.to_usb()) + bytearray(4)
+        else:
+            self._tdi_hdr = None
         if xsjtag == None:
             self._xsusb = XsUsb(xsusb_id)
             self.xsjtag = XsJtag(self._xsusb)
         else:
             self.xsjtag = xsjtag
+        self.session = XsHostIoSession.get(self.xsjtag)
         self.user_instr = self.USER1_INSTR
-        self.initialize()
+        # Limit on the result bytes requested from the board before they're read back.
+        self.max_pending_bytes = self._MAX_PENDING_BYTES
+        self.session.select(self.user_instr)  # Only loads the USER instruction if it isn't already active.
 
     def initialize(self):
         """Initialize the USB I/O link."""
 
         assert self.xsjtag != None
-        self.xsjtag.reset_tap()  # Reset TAP FSM to test-logic-reset state.
+        self.session.select(self.user_instr, force=True)
 
-        # Send TAP FSM to the shift-ir state.
-        self.xsjtag.go_thru_tap_states('Run-Test/Idle', 'Select-DR-Scan', 'Select-IR-Scan', 'Capture-IR', 'Shift-IR')
+    def _get_params(self, kind, fetch):
+        """Return parameters of the module that are fetched once per FPGA configuration."""
 
-        # Now enter the USER1 JTAG instruction into the IR and go to the exit1-ir state.
-        self.xsjtag.shift_tdi(tdi=self.user_instr, do_exit_shift=True)
-
-        # USER instruction is now active, so transfer to the shift-dr state where data transfers will occur.
-        self.xsjtag.go_thru_tap_states('Update-IR', 'Select-DR-Scan', 'Capture-DR', 'Shift-DR')
-        self.xsjtag.flush()
+        return self.session.get_module_params(self.user_instr, self.module_id, kind, fetch)
 
     def reset(self):
         """Reset the USB I/O link."""
 
         self.initialize()
 
+    def _make_tdi(self, payload, num_result_bits):
+        """Return the TDI bit array for a transaction with the module.
+
+        The TDI bits are the concatenation of the module ID, the total number of
+        payload and result bits, and the payload bits.
+        """
+
+        return self.module_id + XsBitArray(uint=payload.len + num_result_bits, length=32) + payload
+
+    def _shift_tdi_usb(self, payload_bytes, num_payload_bits, num_result_bits):
+        """Shift the TDI bits for a transaction with the module whose payload is a byte array in USB order."""
+
+        if self._tdi_hdr is None:
+            payload = XsBitArray.from_usb(usb_bytes=payload_bytes, length=num_payload_bits)
+            self.xsjtag.shift_tdi(tdi=self._make_tdi(payload, num_result_bits))
+            return
+
+        # Fill in the bit count in a copy of the header and then send the header and payload.
+        tdi_hdr = self._tdi_hdr[:]
+        struct.pack_into('<I', tdi_hdr, len(tdi_hdr) - 4, num_payload_bits + num_result_bits)
+        self.xsjtag.shift_tdi_usb(tdi_hdr, len(tdi_hdr) * 8)
+        if num_payload_bits > 0:
+            self.xsjtag.shift_tdi_usb(payload_bytes, num_payload_bits)
+
+    def send(self, payloads):
+        """Send a list of bit array payloads that return no results in a single USB transfer."""
+
+        logging.debug('Send ' + str(len(payloads)) + ' payloads.')
+
+        self.session.select(self.user_instr)
+
+        # The transactions are all shifted into the TDI pin with a single JTAG command.
+        for payload in payloads:
+            self._shift_tdi_usb(payload.to_usb(), payload.len, 0)
+        self.xsjtag.flush()
+
     def send_rcv(self, payload, num_result_bits):
         """Send a bit array payload and then return a results bit array with num_result_bits."""
 
-        logging.debug('Send ' + str(payload.len) + ' bits. Receive ' + str(num_result_bits) + ' bits.')
+        logging.debug('payload = ' + repr(payload))
+        result_bytes = self.send_rcv_bytes(payload.to_usb(), payload.len, num_result_bits)
+        return XsBitArray.from_usb(usb_bytes=result_bytes, length=num_result_bits)
+
+    def send_rcv_bytes(self, payload_bytes, num_payload_bits=None, num_result_bits=0):
+        """Send a payload byte array and then return a byte array with num_result_bits result bits.
+        
+        payload_bytes = payload in USB order (first bit in the least-significant bit of the first byte).
+        num_payload_bits = number of payload bits (or all the bits in payload_bytes if None).
+        num_result_bits = number of result bits to get from the module.
+        
+        The result is also in USB order with any unused bits in the last byte set to zero.
+        """
 
-        # Create the TDI bit array by concatenating the module ID, number of bits in the payload, and the payload bits.
-        tdi_bits = self.module_id + XsBitArray(uint=payload.len + num_result_bits, length=32) + payload
+        if num_payload_bits == None:
+            num_payload_bits = len(payload_bytes) * 8
 
+        logging.debug('Send ' + str(num_payload_bits) + ' bits. Receive ' + str(num_result_bits) + ' bits.')
         logging.debug('Module ID = ' + repr(self.module_id))
-        logging.debug('payload = ' + repr(payload))
-        logging.debug('# TDI bits = ' + str(tdi_bits.len))
-        logging.debug('TDI = ' + repr(tdi_bits))
 
-        # Send the TDI bits.
-        self.xsjtag.shift_tdi(tdi=tdi_bits)
-        self.xsjtag.flush()
-        # Get the result bits from TDO.
-        tdo_bits = self.xsjtag.shift_tdo(num_result_bits)
-        return tdo_bits
+        # Send the TDI bits and get the result bits from TDO. (Short transactions go out as a single JTAG command.)
+        self.session.select(self.user_instr)
+        self._shift_tdi_usb(payload_bytes, num_payload_bits, num_result_bits)
+        if num_result_bits == 0:
+            # Nothing comes back, so send the transaction now instead of leaving it in the JTAG buffers.
+            self.xsjtag.flush()
+            return bytearray()
+        return self.xsjtag.shift_tdo_usb(num_result_bits)
+
+
+    def send_rcv_batch(self, requests):
+        """Perform transactions with several modules using as few JTAG scans and USB exchanges as possible.
+        
+        requests = List of (module_id, payload, num_result_bits) tuples where module_id
+                   is an integer or bit array, payload is a bit array and num_result_bits
+                   is the number of result bits to get back from the module.
+        
+        All the modules must respond to the same USER instruction as this object.
+        Returns a list with a result bit array for each request.
+        """
+
+        # Serialize the transactions into TDI bit streams. Zeroes are shifted in while
+        # each module returns its results and the next transaction starts right after them.
+        # The board can't take in TDI bits while it's holding more TDO bits than the host
+        # has read, so each stream is limited to what the board can hold.
+        results = []
+        tdi_bits = XsBitVec()
+        result_fields = []  # (# bits before the results, # result bits) for each request in the stream.
+        for (module_id, payload, num_result_bits) in requests:
+            if isinstance(module_id, int):
+                module_id = XsBitVec(uint=module_id, length=8)
+            xact_bits = XsBitVec(module_id) + XsBitVec(uint=payload.len + num_result_bits, length=32) + payload
+            if len(result_fields) > 0 and \
+                    (tdi_bits.len + xact_bits.len + num_result_bits + 7) // 8 > self.max_pending_bytes:
+                results.extend(self._send_rcv_stream(tdi_bits, result_fields))
+                tdi_bits = XsBitVec()
+                result_fields = []
+            if (xact_bits.len + num_result_bits + 7) // 8 > self.max_pending_bytes:
+                # Too many results to get back while shifting in the TDI bits, so send
+                # the transaction and then fetch its results.
+                self.session.select(self.user_instr)
+                self.xsjtag.shift_tdi_usb(xact_bits.to_usb(), xact_bits.len)
+                result_bytes = self.xsjtag.shift_tdo_usb(num_result_bits)
+                results.append(XsBitArray.from_usb(usb_bytes=result_bytes, length=num_result_bits))
+                continue
+            tdi_bits += xact_bits
+            result_fields.append((tdi_bits.len, num_result_bits))
+            tdi_bits += XsBitVec(num_result_bits)
+        if len(result_fields) > 0:
+            results.extend(self._send_rcv_stream(tdi_bits, result_fields))
+        return results
+
+    def _send_rcv_stream(self, tdi_bits, result_fields):
+        """Shift a stream of transactions into the modules and return a list of their results."""
+
+        logging.debug('Batch of ' + str(len(result_fields)) + ' transactions with ' + str(tdi_bits.len) + ' TDI bits.')
+
+        self.session.select(self.user_instr)
+        tdo_bytes = self.xsjtag.shift_tdi_tdo_usb(tdi_bits.to_usb(), tdi_bits.len)
+
+        # Split the TDO bit stream into the results for each transaction.
+        tdo_bits = XsBitArray.from_usb(usb_bytes=tdo_bytes, length=tdi_bits.len)
+        reader = XsBitReader(tdo_bits)
+        results = []
+        for (start, num_result_bits) in result_fields:
+            reader.skip(start - reader.pos)
+            results.append(reader.read(num_result_bits))
+        return results
+
+    def discover_modules(self, module_ids=range(256)):
+        """Return a dictionary of the modules in the FPGA that respond to this object's USER instruction.
+        
+        module_ids = List of module IDs to probe.
+        
+        Each entry maps a module ID to the pair of widths the module reports:
+        (address width, data width) for a memory module or (# inputs, # outputs) for a DUT module.
+        The probes are sent with send_rcv_batch(), so they go out in a few streamed
+        batches limited by max_pending_bytes (about 16 for all 256 IDs) rather than one
+        exchange per module. The result is remembered until the FPGA is reconfigured.
+        """
+
+        module_ids = tuple(module_ids)
+        key = (self.user_instr.bin, module_ids, 'inventory')
+        return dict(self.session.get_params(key, lambda: self._scan_modules(module_ids)))
+
+    def _scan_modules(self, module_ids):
+        """Send the size opcode to each module ID and return a dictionary of the ones that answer."""
+
+        SKIP_CYCLES = 1  # Skip cycles between issuing command and reading back result.
+
+        requests = [(id, self._SIZE_OPCODE, self._SIZE_RESULT_LENGTH + SKIP_CYCLES) for id in module_ids]
+        results = self.send_rcv_batch(requests)
+
+        modules = {}
+        for (id, params) in zip(module_ids, results):
+            reader = XsBitReader(params)
+            reader.skip(SKIP_CYCLES)  # Skip the skipped cycles.
+            widths = (reader.read_uint(self._SIZE_RESULT_LENGTH / 2), reader.read_uint(self._SIZE_RESULT_LENGTH / 2))
+            if widths != (0, 0):  # Module IDs with nothing attached return all zeroes.
+                modules[id] = widths
+        logging.debug('Modules found: ' + repr(modules))
+        return modules
 
 
 if __name__ == '__main__':
@@ -25,15 +25,151 @@ USB <=> JTAG port interface for an XESS FPGA board.
 """
 
 import logging
+import re
+import binascii
 from xserror import *
 from xsbitarray import *
 from xsusb import XsUsb
 
 
+class _BitBuffer:
+
+    """Growable buffer of bits packed into bytes in the order they're sent over USB.
+    
+    The first bit is stored in the least-significant bit of the first byte, which is the
+    order the XESS board expects in a JTAG_CMD packet. Unused bits in the last byte are zero.
+    """
+
+    def __init__(self, bits=None):
+        self.clear()
+        if bits != None:
+            self.append_bits(bits)
+
+    def clear(self):
+        self.bytes = bytearray()
+        self.len = 0
+
+    def append_bit(self, bit):
+        """Append a single bit."""
+
+        if self.len % 8 == 0:
+            self.bytes.append(0)
+        if bit:
+            self.bytes[-1] |= 0x01 << (self.len % 8)
+        self.len += 1
+
+    def append_bits(self, bits):
+        """Append a list of bits in the order they'll be sent."""
+
+        for bit in bits:
+            self.append_bit(bit)
+
+    def append_zeros(self, num_bits):
+        """Append a number of zero bits."""
+
+        self.len += num_bits
+        self.bytes.extend(bytearray((self.len + 7) // 8 - len(self.bytes)))
+
+    def append_usb(self, usb_bytes, num_bits):
+        """Append bits from a byte array that's already in USB order."""
+
+        num_bytes = (num_bits + 7) // 8
+        usb_bytes = bytearray(usb_bytes[:num_bytes])
+        if num_bits % 8 != 0:
+            usb_bytes[-1] &= (0x01 << (num_bits % 8)) - 1  # Clear unused bits in the last byte.
+        shift = self.len % 8
+        if shift == 0:
+            self.bytes.extend(usb_bytes)
+        elif num_bits > 0:
+            # Shift the new bits (as one big integer) up to the first unused bit in the last byte
+            # and merge them with it.
+            v = int(binascii.hexlify(str(usb_bytes[::-1])), 16) << shift | self.bytes.pop()
+            num_bytes = (shift + num_bits + 7) // 8
+            self.bytes.extend(bytearray(binascii.unhexlify('%0*x' % (num_bytes * 2, v)))[::-1])
+        self.len += num_bits
+
+    def append(self, bits):
+        """Append the contents of an XsBitArray or another bit buffer."""
+
+        if isinstance(bits, _BitBuffer):
+            self.append_usb(bits.bytes, bits.len)
+        else:
+            self.append_usb(bits.to_usb(), bits.len)
+
+    def any(self, num_bits=None):
+        """Return True if any of the first num_bits bits (or all the bits if None) are 1."""
+
+        if num_bits == None:
+            num_bits = self.len
+        num_bytes = num_bits // 8
+        if self.bytes.count('\x00', 0, num_bytes) != num_bytes:
+            return True
+        return num_bits % 8 != 0 and self.bytes[num_bytes] & ((0x01 << (num_bits % 8)) - 1) != 0
+
+    def get_bit(self, index):
+        """Return the bit at the given index."""
+
+        return self.bytes[index >> 3] >> (index & 7) & 0x01
+
+    def head_usb(self, num_bits):
+        """Return a byte array with the first num_bits bits in USB order."""
+
+        head = _BitBuffer()
+        head.append_usb(self.bytes, num_bits)
+        return head.bytes
+
+
+def _usb_bit_field(usb_bytes, start, num_bits):
+    """Return a byte array with num_bits bits starting at bit index start of a byte array in USB order."""
+
+    if start % 8 == 0:
+        field = _BitBuffer()
+        field.append_usb(usb_bytes[start // 8:], num_bits)
+        return field.bytes
+    num_bytes = (num_bits + 7) // 8
+    if num_bytes == 0:
+        return bytearray()
+    # Shift the bits (as one big integer) down so the field starts at bit 0 of the first byte.
+    v = int(binascii.hexlify(str(bytearray(usb_bytes)[::-1])), 16) >> start & ((0x01 << num_bits) - 1)
+    return bytearray(binascii.unhexlify('%0*x' % (num_bytes * 2, v)))[::-1]
+
+
+def _find_tms_paths(next_tap_state):
+    """Return a table of the shortest TMS bit sequences that move the TAP FSM between every pair of states.
+    
+    The table is indexed by (start state, end state) and each entry is a pre-packed
+    bit buffer of TMS bits ready to be appended to the TMS buffer.
+    """
+
+    tms_paths = {}
+    for start_state in next_tap_state:
+        if start_state == 'Invalid':
+            continue  # There's no way out of the invalid state except a TAP reset.
+        # Do a breadth-first search from the start state so each state is first reached along its shortest path.
+        tms_seqs = {start_state: []}
+        states = [start_state]
+        while len(states) > 0:
+            next_states = []
+            for state in states:
+                for tms in (0, 0x01):
+                    next_state = next_tap_state[state][tms]
+                    if next_state not in tms_seqs:
+                        tms_seqs[next_state] = tms_seqs[state] + [tms]
+                        next_states.append(next_state)
+            states = next_states
+        for (end_state, tms_seq) in tms_seqs.items():
+            tms_paths[(start_state, end_state)] = _BitBuffer(tms_seq)
+    return tms_paths
+
+
 class XsJtag:
 
     """USB<=>JTAG port interface object for XESS FPGA board."""
 
+    # Most bits that are merged into a single JTAG_CMD carrying both TMS and TDI bits (and
+    # maybe getting TDO bits). This keeps the command and its TDO bits within a 64-byte USB packet.
+    _MAX_COALESCED_BITS = 232
+
     # Table that stores the next JTAG TAP state for a given TAP state and value of TMS.
     # Current TAP state : [Next TAP state if TMS=0, Next TAP state if TMS=1]
     _next_tap_state = {
@@ -56,96 +192,214 @@ class XsJtag:
         'Update-IR': ['Run-Test/Idle', 'Select-DR-Scan'],
         }
 
+    # Table of the shortest TMS bit sequence from any TAP state to any other.
+    _tms_paths = _find_tms_paths(_next_tap_state)
+
     def __init__(self, xsusb=None):
         """Initialize object."""
 
         self._xsusb = xsusb  # USB port to board.
         self._tap_state = 'Invalid'  # Start TAP FSM in undefined state.
-        # Clear bit arrays that store TDI and TMS bits to be sent to board.
-        self._tdi_bits = XsBitArray()
-        self._tms_bits = XsBitArray()
+        self.instr = None  # Instruction in the JTAG IR (None if unknown).
+        # Clear buffers that store TDI and TMS bits to be sent to board.
+        self._tdi_bits = _BitBuffer()
+        self._tms_bits = _BitBuffer()
+        # Runs of constant TDI bytes at least this long are sent as static TDI values (0 disables this).
+        self.rle_min_bytes = 32
 
     def _buffer_is_empty(self):
         """Return True if both TDI and TMS bit buffers are empty."""
 
-        return self._tdi_bits.len == 0 and self._tms_bits.len == 0
+        # The TMS and TDI buffers always hold the same number of bits (one of each per TCK).
+        return self._tms_bits.len == 0
 
     def shift_tms(self, tms):
         """Append the TMS bit to the TMS bit buffer and update the TAP state."""
 
         assert tms == 0 or tms == 0x01
-        self._tms_bits += [tms]  # Append the bit to the buffer.
+        self._tms_bits.append_bit(tms)  # Append the bit to the buffer.
+        self._tdi_bits.append_bit(0)  # TDI is zero while TMS moves the TAP FSM.
         logging.debug('Current TAP state = %s', self._tap_state)
 
         # Update the TAP state given the current state and the TMS bit value.
         self._tap_state = self._next_tap_state[self._tap_state][tms]
         logging.debug('New TAP state = %s', self._tap_state)
 
+    def _append_shift_tms(self, num_bits, do_exit_shift):
+        """Append the TMS bits that hold the TAP FSM in a shift state while num_bits are shifted.
+        
+        do_exit_shift = True if the last TMS bit should be 1 to exit the shift-ir or shift-dr state.
+        """
+
+        if do_exit_shift:
+            # TMS=1 on the last bit exits the shift-ir/dr state.
+            self._tms_bits.append_zeros(num_bits - 0x01)
+            self._tms_bits.append_bit(0x01)
+            self._tap_state = self._next_tap_state[self._tap_state][0x01]
+        else:
+            self._tms_bits.append_zeros(num_bits)
+
     def shift_tdi(self, tdi, do_exit_shift=False):
         """Append given bits to the TDI bit buffer.
         
         do_exit_shift = True if shift-ir or shift-dr state should be exited on last TDI bit.
         """
 
-        # Flush any pending TMS bits before TDI bits are sent.
-        if self._tms_bits.len > 0:
-            self.flush()
-
-        # TAP FSM must be in the shift-ir or shift-dr state if fetching TDO bits.
-        assert self._tap_state == 'Shift-DR' or self._tap_state == 'Shift-IR'
-
         # Create a single-item bit array if just a single bit is being sent.
         if not isinstance(tdi, XsBitArray):
             tdi = XsBitArray([tdi])
 
-        # Append the TDI bits to the end of the TDI buffer.
-        self._tdi_bits += tdi
+        self.shift_tdi_usb(tdi.to_usb(), tdi.len, do_exit_shift)
+
+    def shift_tdi_usb(self, tdi_bytes, num_bits, do_exit_shift=False):
+        """Append TDI bits from a byte array that's already in USB order to the TDI bit buffer.
+        
+        tdi_bytes = byte array with the first TDI bit in the least-significant bit of the first byte.
+        num_bits = number of TDI bits in the byte array.
+        do_exit_shift = True if shift-ir or shift-dr state should be exited on last TDI bit.
+        """
+
+        # TAP FSM must be in the shift-ir or shift-dr state if sending TDI bits.
+        assert self._tap_state == 'Shift-DR' or self._tap_state == 'Shift-IR'
+
+        # Pending TMS bits are sent in the same command as the TDI bits unless that would make it too large.
+        if self._tms_bits.len + num_bits > self._MAX_COALESCED_BITS and self._tms_bits.any():
+            self.flush()
+
+        # Append the TDI bits to the end of the TDI buffer along with the TMS bits for the shift state.
+        self._tdi_bits.append_usb(tdi_bytes, num_bits)
+        self._append_shift_tms(num_bits, do_exit_shift)
         if do_exit_shift:
-            self.shift_tms(0x01)  # TMS=1 exits the shift-ir/dr state.
             self.flush()  # Flush everything to the JTAG port.
             assert self._tap_state == 'Exit1-IR' or self._tap_state == 'Exit1-DR'
 
     def shift_tdo(self, num_bits, do_exit_shift=False):
         """Return a bit array with a given number of bits from the TDO pin."""
 
-        # It's an error to gather TDO bits if the USB port is not setup.
-        assert self._xsusb is not None
-
         # Return empty array if no bits are requested.
         if num_bits == 0:
             return XsBitArray()
 
-        # Flush any pending TMS/TDI bits before gathering TDO bits.
-        self.flush()
+        tdo_bits = XsBitArray.from_usb(usb_bytes=self.shift_tdo_usb(num_bits, do_exit_shift), length=num_bits)
+        logging.debug('shift_tdo TDO => %s', tdo_bits)
+        return tdo_bits
+
+    def shift_tdo_usb(self, num_bits, do_exit_shift=False):
+        """Return a byte array with a given number of bits from the TDO pin.
+        
+        The first TDO bit is in the least-significant bit of the first byte and any
+        unused bits in the last byte are zero.
+        """
+
+        # Return empty array if no bits are requested.
+        if num_bits == 0:
+            return bytearray()
 
         # TAP FSM must be in the shift-ir or shift-dr state if fetching TDO bits.
         assert self._tap_state == 'Shift-DR' or self._tap_state == 'Shift-IR'
 
-        if do_exit_shift == True:
+        if do_exit_shift and self._tms_bits.len + num_bits > self._MAX_COALESCED_BITS:
+            # Send the pending TMS/TDI bits first so they can't end up behind the command that exits the shift-ir/dr state.
+            self.flush()
             # Get the first N-1 TDO bits before exiting the shift-ir/dr state.
-            tdo_bits = self.shift_tdo(num_bits=num_bits - 0x01, do_exit_shift=False)
+            tdo_bits = _BitBuffer()
+            tdo_bits.append_usb(self.shift_tdo_usb(num_bits=num_bits - 0x01, do_exit_shift=False), num_bits - 0x01)
             # Now make TMS=1 to exit the shift-ir/dr state while getting the last TDO bit.
-            self.shift_tms(0x01)  # Do this just to update the internal TAP state.
-            self._tms_bits = XsBitArray()  # Then clear the TMS bit buffer.
-            # Now get the final TDO bit and set TMS=1 to exit the shift-ir/dr state.
+            self._tap_state = self._next_tap_state[self._tap_state][0x01]
             cmd = self._make_jtag_cmd_hdr(num_bits=0x01, flags=XsUsb.GET_TDO_MASK | XsUsb.TMS_VAL_MASK)
             self._xsusb.write(cmd)  # Send the JTAG command with TMS=1.
             # Get the final TDO bit and put it on the end of the buffer.
             buffer = self._xsusb.read(0x01)
-            tdo_bits += [buffer[0] & 0x01]
+            tdo_bits.append_bit(buffer[0] & 0x01)
+            tdo_bytes = tdo_bits.bytes
+        else:
+            tdo_bytes = self._get_tdo_usb(num_bits, do_exit_shift)
+        if do_exit_shift:
             assert self._tap_state == 'Exit1-IR' or self._tap_state == 'Exit1-DR'
         else:
+            assert self._tap_state == 'Shift-IR' or self._tap_state == 'Shift-DR'
+        return tdo_bytes
+
+    def _get_tdo_usb(self, num_bits, do_exit_shift=False):
+        """Send the command for getting TDO bits along with any pending TMS/TDI bits and return the TDO bits.
+        
+        do_exit_shift can only be True if the pending and TDO bits fit into a single command.
+        """
+
+        # It's an error to gather TDO bits if the USB port is not setup.
+        assert self._xsusb is not None
+
+        # TAP FSM must be in the shift-ir or shift-dr state if fetching TDO bits.
+        assert self._tap_state == 'Shift-DR' or self._tap_state == 'Shift-IR'
+
+        num_pending = self._tms_bits.len
+        if (num_pending > 0 or do_exit_shift) and num_pending + num_bits <= self._MAX_COALESCED_BITS:
+            # Send the pending TMS/TDI bits and the bits for shifting out TDO (including the
+            # exit from the shift-ir/dr state) in a single command.
+            self._tdi_bits.append_zeros(num_bits)
+            self._append_shift_tms(num_bits, do_exit_shift)
+            if self._tms_bits.any():
+                cmd = self._make_tms_tdi_cmd(flags=XsUsb.GET_TDO_MASK)
+            else:
+                # TMS stays at 0, so only the TDI bits have to be sent.
+                cmd = self._make_jtag_cmd_hdr(num_bits=self._tdi_bits.len, flags=XsUsb.PUT_TDI_MASK | XsUsb.GET_TDO_MASK)
+                cmd.extend(self._tdi_bits.bytes)
+            self._tms_bits.clear()
+            self._tdi_bits.clear()
+            self._xsusb.write(cmd)
+        else:
+            assert do_exit_shift == False
+            # Flush any pending TMS/TDI bits before gathering TDO bits.
+            self.flush()
+            num_pending = 0
             # Get the TDO bits but do not exit the shift-ir/dr state.
             cmd = self._make_jtag_cmd_hdr(num_bits=num_bits, flags=XsUsb.GET_TDO_MASK)
             self._xsusb.write(cmd)  # Send the JTAG command with TMS=0.
-            # Now get a USB packet with enough bytes to hold all the requested bits.
-            num_bytes = int((num_bits + 7) / 8)
-            buffer = self._xsusb.read(num_bytes)
-            # Turn the byte array into a bit array.
-            tdo_bits = XsBitArray.from_usb(usb_bytes=buffer, length=num_bits)
-            assert self._tap_state == 'Shift-IR' or self._tap_state == 'Shift-DR'
-        logging.debug('shift_tdo TDO => %s', tdo_bits)
-        return tdo_bits
+        # Get the TDO bits and discard the ones received while any pending bits were sent.
+        num_bytes = int((num_pending + num_bits + 7) / 8)
+        buffer = self._xsusb.read(num_bytes)
+        return _usb_bit_field(buffer, num_pending, num_bits)
+
+    def shift_tdi_tdo_usb(self, tdi_bytes, num_bits):
+        """Shift TDI bits into the JTAG port and return the TDO bits that come out while they're shifted.
+        
+        tdi_bytes = byte array of TDI bits in USB order.
+        num_bits = number of TDI bits in the byte array.
+        
+        The TDO bits are returned as a byte array in USB order and the TAP FSM stays in the shift-ir/dr state.
+        """
+
+        # It's an error to gather TDO bits if the USB port is not setup.
+        assert self._xsusb is not None
+
+        if num_bits == 0:
+            return bytearray()
+
+        # TAP FSM must be in the shift-ir or shift-dr state if sending TDI and fetching TDO bits.
+        assert self._tap_state == 'Shift-DR' or self._tap_state == 'Shift-IR'
+
+        # Pending bits are sent in the same command as the TDI bits unless that would make it too large
+        # (or make the board return a lot of TDO bits that are just thrown away).
+        if self._tms_bits.len > 0 and self._tms_bits.len + num_bits > self._MAX_COALESCED_BITS:
+            self.flush()
+        num_pending = self._tms_bits.len
+
+        self._tdi_bits.append_usb(tdi_bytes, num_bits)
+        self._append_shift_tms(num_bits, do_exit_shift=False)
+        if self._tms_bits.any():
+            cmd = self._make_tms_tdi_cmd(flags=XsUsb.GET_TDO_MASK)
+        else:
+            # TMS stays at 0, so only the TDI bits have to be sent.
+            cmd = self._make_jtag_cmd_hdr(num_bits=self._tdi_bits.len, flags=XsUsb.PUT_TDI_MASK | XsUsb.GET_TDO_MASK)
+            cmd.extend(self._tdi_bits.bytes)
+        self._tms_bits.clear()
+        self._tdi_bits.clear()
+        self._xsusb.write(cmd)
+
+        # Get the TDO bits and discard the ones received while any pending bits were sent.
+        num_bytes = int((num_pending + num_bits + 7) / 8)
+        buffer = self._xsusb.read(num_bytes)
+        return _usb_bit_field(buffer, num_pending, num_bits)
 
     def _make_jtag_cmd_hdr(self, num_bits=0, flags=0):
         """Create the first six bytes of a JTAG_CMD command packet.
@@ -165,6 +419,58 @@ class XsJtag:
             flags,
             ])
 
+    def _make_tdi_cmds(self, tdi_bytes, num_bits):
+        """Return a list of JTAG_CMD packets that send TDI bits (in byte array format) to the JTAG port.
+        
+        Runs of all-zero or all-one bytes that are at least rle_min_bytes long are sent
+        as static TDI values so only the header of their JTAG_CMD packet goes over the USB link.
+        """
+
+        cmds = []
+        pos = 0  # Index of the first TDI byte that hasn't been put into a packet yet.
+        if self.rle_min_bytes > 0:
+            const_run = re.compile(r'\x00{%d,}|\xff{%d,}' % (self.rle_min_bytes, self.rle_min_bytes))
+            # Only whole bytes can be part of a run, so leave any partial last byte out of the search.
+            for run in const_run.finditer(tdi_bytes, 0, num_bits // 8):
+                if run.start() > pos:
+                    # Send the explicit TDI bits before the run.
+                    cmd = self._make_jtag_cmd_hdr(num_bits=(run.start() - pos) * 8, flags=XsUsb.PUT_TDI_MASK)
+                    cmd.extend(tdi_bytes[pos:run.start()])
+                    cmds.append(cmd)
+                # Send the run of bits as a static TDI value.
+                flags = XsUsb.TDI_VAL_MASK if tdi_bytes[run.start()] == 0xff else 0
+                cmds.append(self._make_jtag_cmd_hdr(num_bits=(run.end() - run.start()) * 8, flags=flags))
+                pos = run.end()
+        if pos * 8 < num_bits:
+            # Send the explicit TDI bits after the last run.
+            cmd = self._make_jtag_cmd_hdr(num_bits=num_bits - pos * 8, flags=XsUsb.PUT_TDI_MASK)
+            cmd.extend(tdi_bytes[pos:])
+            cmds.append(cmd)
+        return cmds
+
+    def _make_tms_tdi_cmd(self, flags=0, num_bits=None, tms_buffer=None, tdi_buffer=None):
+        """Create a JTAG_CMD packet that sends both TMS and TDI bits.
+        flags = Additional JTAG_CMD flags OR'ed together.
+        num_bits, tms_buffer, tdi_buffer = Number of bits and the TMS and TDI bytes to send (the buffered bits if None).
+        """
+
+        if num_bits == None:
+            num_bits = self._tms_bits.len
+            tms_buffer = self._tms_bits.bytes
+            tdi_buffer = self._tdi_bits.bytes
+        assert len(tms_buffer) == len(tdi_buffer)
+        # Create the JTAG_CMD header for sending both the TDI and TMS bits.
+        buffer = self._make_jtag_cmd_hdr(num_bits=num_bits, flags=XsUsb.PUT_TMS_MASK | XsUsb.PUT_TDI_MASK | flags)
+        # Create another byte array to hold the interleaved TDI and TMS buffers.
+        tms_tdi_buffer = bytearray(len(tms_buffer) + len(tdi_buffer))
+        # Interleave TMS and TDI bytes with the TMS bytes at even addresses...
+        tms_tdi_buffer[0::2] = tms_buffer
+        # ... and the TDI bytes at odd addresses.
+        tms_tdi_buffer[0x01::2] = tdi_buffer
+        # Append the TDI and TMS byte arrays to the JTAG_CMD header.
+        buffer.extend(tms_tdi_buffer)
+        return buffer
+
     def flush(self):
         """Flush the TDI/TMS buffers through the USB port."""
 
@@ -175,73 +481,67 @@ class XsJtag:
         if self._buffer_is_empty():
             return
 
-        if self._tdi_bits.len == 0:
-            # No TDI bits to send, so just send the TMS bits.
+        # The TMS and TDI bits are already packed in USB order, so they go straight into the JTAG_CMD packets.
+        num_bits = self._tms_bits.len
+        if not self._tms_bits.any():
+            # TMS stays at 0, so just send the TDI bits.
+            cmds = self._make_tdi_cmds(self._tdi_bits.bytes, num_bits)
+        elif num_bits > self._MAX_COALESCED_BITS and not self._tms_bits.any(num_bits - 0x01):
+            # There's a long string of TDI bits and only the last TMS bit is set (to exit the shift state).
+            # Send the TDI bits by themselves and then the last TDI and TMS bits rather than
+            # doubling the size of the packets with a TMS bit for every TDI bit.
+            cmds = self._make_tdi_cmds(self._tdi_bits.head_usb(num_bits - 0x01), num_bits - 0x01)
+            cmds.append(self._make_tms_tdi_cmd(num_bits=0x01,
+                                               tms_buffer=bytearray([self._tms_bits.get_bit(num_bits - 0x01)]),
+                                               tdi_buffer=bytearray([self._tdi_bits.get_bit(num_bits - 0x01)])))
+        elif not self._tdi_bits.any():
+            # TDI stays at 0, so just send the TMS bits.
             # Create the JTAG_CMD header for sending only the TMS bits.
-            buffer = self._make_jtag_cmd_hdr(num_bits=self._tms_bits.len, flags=XsUsb.PUT_TMS_MASK)
+            buffer = self._make_jtag_cmd_hdr(num_bits=num_bits, flags=XsUsb.PUT_TMS_MASK)
             # Append the TMS bits (in byte array format) to the JTAG_CMD header.
-            buffer.extend(self._tms_bits.to_usb())
+            buffer.extend(self._tms_bits.bytes)
+            cmds = [buffer]
         else:
-            if self._tms_bits.len == 0:
-                # No TMS bits to send, so just send the TDI bits.
-                # Create the JTAG_CMD header for sending only the TDI bits.
-                buffer = self._make_jtag_cmd_hdr(num_bits=self._tdi_bits.len, flags=XsUsb.PUT_TDI_MASK)
-                # Append the TDI bits (in byte array format) to the JTAG_CMD header.
-                buffer.extend(self._tdi_bits.to_usb())
-            else:
-                # Both TMS and TDI bits need to be sent.
-                if self._tms_bits.len == self._tdi_bits.len:
-                    # TDI and TMS bit buffers are equal in #bits.
-                    # Create the JTAG_CMD header for sending both the TDI and TMS bits.
-                    buffer = self._make_jtag_cmd_hdr(num_bits=self._tdi_bits.len, flags=XsUsb.PUT_TMS_MASK | XsUsb.PUT_TDI_MASK)
-                    # Create byte arrays to hold the TDI and TMS bits for USB transfer.
-                    tms_buffer = self._tms_bits.to_usb()
-                    tdi_buffer = self._tdi_bits.to_usb()
-                    # Create another byte array to hold the interleaved TDI and TMS buffers.
-                    tms_tdi_buffer = bytearray(len(tms_buffer) + len(tdi_buffer))
-                    # Interleave TMS and TDI bytes with the TMS bytes at even addresses...
-                    tms_tdi_buffer[0::2] = tms_buffer
-                    # ... and the TDI bytes at odd addresses.
-                    tms_tdi_buffer[0x01::2] = tdi_buffer
-                    # Append the TDI and TMS byte arrays to the JTAG_CMD header.
-                    buffer.extend(tms_tdi_buffer)
-                elif self._tms_bits.len == 0x01:
-                    # There's multiple TDI bits but only one TMS bit.
-                    # Remove the last TMS and TDI bits from the buffers.
-                    last_tms_bit = self._tms_bits.tail(0x01)
-                    self._tms_bits = self._tms_bits.head(self._tms_bits.len - 0x01)
-                    last_tdi_bit = self._tdi_bits.tail(0x01)
-                    self._tdi_bits = self._tdi_bits.head(self._tdi_bits.len - 0x01)
-                    assert self._tms_bits.len == 0
-                    assert self._tdi_bits.len != 0
-                    # Now only TDI bits remain, so flush those.
-                    self.flush()
-                    # Now put the last TDI and TMS bits into the buffers and flush those.
-                    self._tms_bits += [last_tms_bit]
-                    self._tdi_bits += [last_tdi_bit]
-                    self.flush()
-                    return
-                else:
-                    # It's an error if we ever get here! That would mean there are
-                    # both multiple TMS and TDI bits, but not the same number of each.
-                    assert False
-
-        # Send the JTAG_CMD packet with the attached TMS and/or TDI bits.
-        self._xsusb.write(buffer)
+            # Send the TMS and TDI bits together in a single command.
+            cmds = [self._make_tms_tdi_cmd()]
+
+        # Send the JTAG_CMD packets with the attached TMS and/or TDI bits.
+        for cmd in cmds:
+            self._xsusb.write(cmd)
 
         # Clear the TMS and TDI buffers.
-        self._tms_bits = XsBitArray()
-        self._tdi_bits = XsBitArray()
+        self._tms_bits.clear()
+        self._tdi_bits.clear()
+
+    def _append_tms(self, tms_bits):
+        """Append a bit buffer of TMS bits (with TDI=0) to the buffers without updating the TAP state."""
+
+        self._tms_bits.append(tms_bits)
+        self._tdi_bits.append_zeros(tms_bits.len)
 
     def go_thru_tap_states(self, *states):
         """Go through a sequence of TAP states."""
 
+        tms_seq = []
         for next_state in states:
             assert next_state in self._next_tap_state, 'Illegal TAP state label: %s.' % next_state
             # Make sure the next TAP state is reachable from current state.
             assert next_state == self._next_tap_state[self._tap_state][0] or next_state == self._next_tap_state[self._tap_state][0x01]
-            # Append the TMS bit that will move the TAP FSM to the desired state.
-            self.shift_tms(next_state == self._next_tap_state[self._tap_state][0x01])
+            # Record the TMS bit that will move the TAP FSM to the desired state.
+            tms_seq.append(int(next_state == self._next_tap_state[self._tap_state][0x01]))
+            self._tap_state = next_state
+        # Append all the TMS bits to the buffer at once.
+        self._append_tms(_BitBuffer(tms_seq))
+        logging.debug('New TAP state = %s', self._tap_state)
+
+    def goto_state(self, state):
+        """Move the TAP FSM to the given state along the shortest path."""
+
+        assert state in self._next_tap_state and state != 'Invalid', 'Illegal TAP state label: %s.' % state
+        if self._tap_state == 'Invalid':
+            self.reset_tap()  # Get the TAP FSM into a known state first.
+        self._append_tms(self._tms_paths[(self._tap_state, state)])
+        self._tap_state = state
 
     def load_ir_then_dr(
         self,
@@ -258,14 +558,15 @@ class XsJtag:
         # The TAP FSM should always start and return to the run-test/idle state until all instructions are done.
         if self._tap_state != 'Run-Test/Idle':
             self.reset_tap()
-            self.go_thru_tap_states('Run-Test/Idle')
+            self.goto_state('Run-Test/Idle')
 
         if instruction != None:
             # Go  to the shift-ir state.
-            self.go_thru_tap_states('Select-DR-Scan', 'Select-IR-Scan', 'Capture-IR', 'Shift-IR')
+            self.goto_state('Shift-IR')
             # Now shift in the instruction opcode and activate it.
             self.shift_tdi(tdi=instruction, do_exit_shift=True)
-            self.go_thru_tap_states('Update-IR')
+            self.goto_state('Update-IR')
+            self.instr = XsBitArray(instruction)
 
         # TAP FSM can get to select-dr-scan from either of these states.
         assert self._tap_state == 'Run-Test/Idle' or self._tap_state == 'Update-IR'
@@ -274,18 +575,18 @@ class XsJtag:
             # If there's data to send, then there should never be data to return.
             assert num_return_bits == 0
             # Go  to the shift-dr state.
-            self.go_thru_tap_states('Select-DR-Scan', 'Capture-DR', 'Shift-DR')
+            self.goto_state('Shift-DR')
             # Now shift in the data for the instruction.
             self.shift_tdi(tdi=data, do_exit_shift=True)
-            self.go_thru_tap_states('Update-DR')
+            self.goto_state('Update-DR')
         elif num_return_bits != 0:
             # No data to send, but there is data to receive from the DR.
-            self.go_thru_tap_states('Select-DR-Scan', 'Capture-DR', 'Shift-DR')
+            self.goto_state('Shift-DR')
             # Shift the data out of the DR.
             bits = self.shift_tdo(num_bits=num_return_bits, do_exit_shift=True)
-            self.go_thru_tap_states('Update-DR')
+            self.goto_state('Update-DR')
         assert self._tap_state == 'Run-Test/Idle' or self._tap_state == 'Update-IR' or self._tap_state == 'Update-DR'
-        self.go_thru_tap_states('Run-Test/Idle')
+        self.goto_state('Run-Test/Idle')
         self.flush()
         return bits
 
@@ -296,13 +597,13 @@ class XsJtag:
         self.flush()
 
         # Setting TMS=1 for five clocks guarantees TAP is in test-logic-reset state.
-        for i in range(0, 5):
-            self.shift_tms(0x01)
+        self._append_tms(_BitBuffer([0x01] * 5))
         self.flush()
         self._tap_state = 'Test-Logic-Reset'
+        self.instr = None  # The IR now holds the default instruction for the device.
 
     def run_test_idle(self):
-        self.go_thru_tap_states('Run-Test/Idle')
+        self.goto_state('Run-Test/Idle')
 
     def runtest(self, num_tcks):
         """Clock the JTAG port a given number of times."""
@@ -316,9 +617,28 @@ class XsJtag:
         self._xsusb.write(cmd)  # Send the command.
 
         # Check that the 1st byte of the command response matches the command opcode.
-        if self._xsusb.read(5)[0] != XsUsb.RUNTEST_CMD:
+        # (There's no response to check if the board has been told not to send one.)
+        if self._xsusb.return_enabled and self._xsusb.read(5)[0] != XsUsb.RUNTEST_CMD:
             raise XsMajorError("Communication error with XESS board in 'runtest'.")
 
+    def can_disable_return(self):
+        """Return true if the board can stop sending command responses."""
+
+        self.flush()
+        return self._xsusb.is_return_control_supported()
+
+    def disable_return(self):
+        """Stop the board from sending command responses so write-only JTAG sequences can be streamed."""
+
+        self.flush()
+        self._xsusb.disable_return()
+
+    def enable_return(self):
+        """Turn command responses back on and check the write-only JTAG sequence got through."""
+
+        self.flush()
+        self._xsusb.enable_return()
+
 
 if __name__ == '__main__':
     logging.root.setLevel(logging.DEBUG)
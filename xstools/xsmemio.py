@@ -28,6 +28,7 @@ of an XESS board through the USB port.
 import logging
 import itertools
 import struct
+import collections
 from xshostio import *
 
 
@@ -41,6 +42,8 @@ class XsMemIo(XsHostIo):
     _WRITE_OPCODE = XsBitArray('0b10')  # Write to memory.
     _SIZE_OPCODE  = XsBitArray('0b01')  # Get the address and data widths of memory.
     _SIZE_RESULT_LENGTH = 16  # Length of _SIZE_OPCODE result.
+    _WORD_TYPES = {8:'B', 16:'H', 32:'I', 64:'Q'}  # struct formats for byte-sized data widths.
+    _MAX_XFER_BITS = 2 ** 18  # Data bits in the largest transaction a read or write is split into.
 
     def __init__(
         self,
@@ -59,12 +62,15 @@ class XsMemIo(XsHostIo):
         XsHostIo.__init__(self, xsjtag=xsjtag, xsusb_id=xsusb_id, module_id=module_id)
 
         # Get the number of inputs and outputs of the DUT.
-        (self.address_width, self.data_width) = self._get_mem_widths()
+        (self.address_width, self.data_width) = self._get_params('mem_widths', self._get_mem_widths)
         assert self.address_width != 0
         assert self.data_width != 0
         logging.debug('address width = ' + str(self.address_width))
         logging.debug('data width = ' + str(self.data_width))
 
+        # Reads and writes larger than this are split into several transactions.
+        self.max_xfer_words = max(1, self._MAX_XFER_BITS // self.data_width)
+
     def _get_mem_widths(self):
         """Return the (address_width, data_width) of the memory."""
 
@@ -73,13 +79,14 @@ class XsMemIo(XsHostIo):
         # Send the opcode and then read back the bits with the memory's address and data width.
         params = self.send_rcv(payload=self._SIZE_OPCODE,
                                num_result_bits=self._SIZE_RESULT_LENGTH + SKIP_CYCLES)
-        params.pop_field(SKIP_CYCLES)  # Remove the skipped cycles.
+        reader = XsBitReader(params)
+        reader.skip(SKIP_CYCLES)  # Skip the skipped cycles.
 
         # The address width is in the first half of the bit array.
-        address_width = params.pop_field(self._SIZE_RESULT_LENGTH / 2).unsigned
+        address_width = reader.read_uint(self._SIZE_RESULT_LENGTH / 2)
 
         # The data width is in the last half of the bit array.
-        data_width = params.pop_field(self._SIZE_RESULT_LENGTH / 2).unsigned
+        data_width = reader.read_uint(self._SIZE_RESULT_LENGTH / 2)
         return (address_width, data_width)
 
     def read(self, begin_address, num_of_reads=1, return_type=XsBitArray()):
@@ -90,63 +97,45 @@ class XsMemIo(XsHostIo):
         return_type = instance of the type of data to return. Negative integer=signed; positive integer=unsigned.
         """
 
-        # Start the payload with the READ_OPCODE.
-        payload = XsBitArray(self._READ_OPCODE)
-
-        # Append the memory address to the payload.
-        payload += XsBitArray(uint=begin_address, length=self.address_width)
+        if num_of_reads > self.max_xfer_words:
+            return self._read_xfers(begin_address, num_of_reads, return_type)
 
         # Send the opcode and beginning address and then read back the memory data.
         # The number of values read back is one more than requested because the first value
         # returned is crap since the memory isn't ready to respond.
-        result = self.send_rcv(payload=payload,
-                               num_result_bits=self.data_width * (num_of_reads + 1))
+        hdr = self._make_hdr(self._READ_OPCODE, begin_address)
+        result = self.send_rcv_bytes(hdr.to_usb(), hdr.len, self.data_width * (num_of_reads + 1))
+        values = self._decode_reads(result, num_of_reads, return_type)
+        if num_of_reads == 1: # Return the value by itself if there's only a single read.
+            return values[0]
+        return values
+
+    def _decode_reads(self, result, num_of_reads, return_type):
+        """Return the values in the USB bytes returned by a read transaction.
+        
+        result = byte array in USB order starting with the crap value that precedes the memory data.
+        num_of_reads = number of memory values following the crap value.
+        return_type = instance of the type of data to return. Negative integer=signed; positive integer=unsigned.
+        """
 
-        if num_of_reads == 1: # Return the result bit array if there's only a single read.
-            result.pop_field(self.data_width)  # Remove the first data value which is crap.
-            if isinstance(return_type, XsBitArray):
-                return result
-            else:
-                if return_type < 0:
-                    return result.int
-                else:
-                    return result.uint
-        else: # Otherwise, return a list of bit arrays with data_width bits by partitioning the result bit array.
-            w = self.data_width
-            l = result.length
-            if isinstance(return_type, XsBitArray):
-                # Chop the bit array into an array of smaller bit arrays.
-                # Start from the far end, skip the first data value which is crap, and then proceed to the beginning.
-                return [result[i:i+w] for i in range(l-2*w,-w,-w)]
-            else: # Return type is not a bit array, so convert bit arrays into integers.
-                try:
-                    # If word width is not byte-sized, then raise exception and
-                    # use the slower method.
-                    if w % 8 != 0:
-                        raise KeyError
-                    # If word width is not 1, 2, 4 or 8 bytes wide, then an
-                    # exception occurs and the slower method is used.
-                    w_type = {1:'B', 2:'H', 4:'I', 8:'Q'}[w // 8]
-                    if return_type < 0:
-                        w_type = str.lower(w_type)
-                    alignment = '>'
-                    n_words = l // w  # Number of words in the bit array.
-                    fmt = '{}{}{}'.format(alignment, n_words, w_type)
-                    # Get bytes from bit array, form them into integers and reverse
-                    # their order so index [0] corresponds to lowest memory address.
-                    # (Skip first integer because it's crap.)
-                    return struct.unpack(fmt, result.bytes)[-2::-1]
-                except KeyError:
-                    # Slower method:
-                    #     Chop the bit array into an array of smaller bit arrays.
-                    #     Start from the far end, skip the first data value 
-                    #     which is crap, and then proceed to the beginning.
-                    results = [result[i:i+w] for i in range(l-2*w,-w,-w)]
-                    if return_type < 0 :
-                        results = [d.int for d in results]
-                    else:
-                        results = [d.uint for d in results]
-                    return results
+        w = self.data_width
+        # Integers with a width of 1, 2, 4 or 8 bytes are unpacked straight from the USB bytes
+        # where they're stored least-significant byte first.
+        w_type = self._WORD_TYPES.get(w)
+        if w_type is not None and not isinstance(return_type, XsBitArray):
+            if return_type < 0:
+                w_type = str.lower(w_type)
+            return struct.unpack_from('<{}{}'.format(num_of_reads, w_type), str(result), w // 8)
+
+        # Otherwise, walk through the fields of the result bit array.
+        reader = XsBitReader(XsBitArray.from_usb(usb_bytes=result, length=w * (num_of_reads + 1)))
+        reader.skip(w)  # Skip the first data value which is crap.
+        if isinstance(return_type, XsBitArray):
+            return [reader.read(w) for i in range(num_of_reads)]
+        elif return_type < 0:
+            return [reader.read_int(w) for i in range(num_of_reads)]
+        else:
+            return [reader.read_uint(w) for i in range(num_of_reads)]
 
     def write(self, begin_address, data, data_type=None):
         """Write a list of bit arrays to the memory.
@@ -156,6 +145,75 @@ class XsMemIo(XsHostIo):
         data_type = instance of data that is stored in the data array. Negative integer=signed; positive integer=unsigned.
         """
 
+        # Send the payloads to write the data to memory. Large amounts of data are
+        # split into several transactions so the payloads stay a reasonable size.
+        for i in range(0, len(data), self.max_xfer_words):
+            payload = self._make_write_payload(begin_address + i, data[i:i + self.max_xfer_words], data_type)
+            self.send_rcv_bytes(payload.to_usb(), payload.len, num_result_bits=0)
+
+    def read_many(self, ranges, return_type=XsBitArray()):
+        """Return a list with the values read from each of a list of memory ranges.
+        
+        ranges = List of (begin address, number of reads) pairs.
+        return_type = instance of the type of data to return. Negative integer=signed; positive integer=unsigned.
+        
+        The reads are batched together so they take about as long as a single read of the same total size.
+        Each range's values are returned as a list even if there is only one of them.
+        """
+
+        w = self.data_width
+        # Make a read transaction for every piece of each range.
+        requests = []
+        pieces = []  # (index of range, # reads) for each read transaction.
+        for (index, (begin_address, num_of_reads)) in enumerate(ranges):
+            for i in range(0, num_of_reads, self.max_xfer_words):
+                n = min(self.max_xfer_words, num_of_reads - i)
+                payload = self._READ_OPCODE + XsBitArray(uint=begin_address + i, length=self.address_width)
+                # The first value returned by each transaction is crap, so get one more than needed.
+                requests.append((self.module_id, payload, w * (n + 1)))
+                pieces.append((index, n))
+
+        results = [[] for r in ranges]
+        for ((index, n), result) in zip(pieces, self.send_rcv_batch(requests)):
+            results[index].extend(self._decode_reads(result.to_usb(), n, return_type))
+        return results
+
+    def write_many(self, ranges, data_type=None):
+        """Write data to a list of memory ranges.
+        
+        ranges = List of (begin address, list of bit arrays or integers) pairs.
+        data_type = instance of data that is stored in the data arrays. Negative integer=signed; positive integer=unsigned.
+        
+        All the writes are sent in as few USB transfers as possible.
+        """
+
+        payloads = []
+        for (begin_address, data) in ranges:
+            for i in range(0, len(data), self.max_xfer_words):
+                payloads.append(self._make_write_payload(begin_address + i, data[i:i + self.max_xfer_words], data_type))
+        if len(payloads) > 0:
+            self.send(payloads)
+
+    def _read_xfers(self, begin_address, num_of_reads, return_type):
+        """Return a list of values read from memory using a transaction for every max_xfer_words values."""
+
+        results = []
+        for index in range(0, num_of_reads, self.max_xfer_words):
+            n = min(self.max_xfer_words, num_of_reads - index)
+            hdr = self._make_hdr(self._READ_OPCODE, begin_address + index)
+            # The first value returned by each transaction is crap, so get one more than needed.
+            result = self.send_rcv_bytes(hdr.to_usb(), hdr.len, self.data_width * (n + 1))
+            results.extend(self._decode_reads(result, n, return_type))
+        return results
+
+    def _make_hdr(self, opcode, address):
+        """Return a bit vector with the opcode followed by the memory address."""
+
+        return XsBitVec(uint=opcode.uint, length=opcode.len) + XsBitVec(uint=address, length=self.address_width)
+
+    def _make_write_payload(self, begin_address, data, data_type=None):
+        """Return the payload bit array for writing a list of bit arrays or integers to the memory."""
+
         if data_type is None:
             if isinstance(data[0], XsBitArray):
                 data_type = data[0]  # XsBitArray.
@@ -172,18 +230,18 @@ class XsMemIo(XsHostIo):
                 index -= w
         else:
             w = self.data_width
-            l = len(data)
-            if w % 8 == 0:
-                words = [[(d>>i) & 0xff for i in range(0,w,8)] for d in data]
-                bytes = [byte for word in words for byte in word]
-                bytes.reverse()
-                payload = BitArray(bytes=bytes)
-            else:
-                payload = XsBitArray(w * len(data))
-                index = w * (len(data)-1)
-                for d in data:
-                    payload.overwrite(XsBitArray(uint=d, length=w), index)
-                    index -= w
+            w_type = self._WORD_TYPES.get(w)
+            if w_type is not None:
+                # Pack the integers straight into USB order (least-significant byte of each word
+                # first) and put the opcode and address in front of them without using bit arrays.
+                mask = (1 << w) - 1
+                data_bytes = struct.pack('<{}{}'.format(len(data), w_type), *[d & mask for d in data])
+                return self._make_hdr(self._WRITE_OPCODE, begin_address) + XsBitVec.from_usb(data_bytes, w * len(data))
+            payload = XsBitArray(w * len(data))
+            index = w * (len(data)-1)
+            for d in data:
+                payload.overwrite(XsBitArray(uint=d, length=w), index)
+                index -= w
 
         # Start the payload with the WRITE_OPCODE.
         header = XsBitArray(self._WRITE_OPCODE)
@@ -194,9 +252,193 @@ class XsMemIo(XsHostIo):
         payload = header + payload
 
         assert payload.len > self._WRITE_OPCODE.len
+        return payload
+
+
+class XsMemCache:
+
+    """Write-back cache of memory pages that lets FPGA memory be indexed like a local array.
+    
+    Reads fill whole pages from the memory and writes are kept in the cache until the
+    pages are flushed or evicted. Pages that have to be fetched or written back together
+    are transferred with a single batch of HostIo transactions.
+    """
+
+    def __init__(self, memio, page_size=256, num_pages=64, return_type=int()):
+        """Create a cache for a memory.
+        
+        memio = XsMemIo object for the memory.
+        page_size = Number of memory words in each cache page.
+        num_pages = Maximum number of pages held in the cache.
+        return_type = Negative integer to return signed values; positive integer for unsigned.
+        """
+
+        if page_size < 1 or num_pages < 1:
+            raise XsMinorError('Cache page size and number of pages must be at least 1.')
+        self._memio = memio
+        self.page_size = page_size
+        self.num_pages = num_pages
+        self._signed = return_type < 0
+        self._width = memio.data_width
+        self._size = 1 << memio.address_width  # Number of words in the memory.
+        self._pages = collections.OrderedDict()  # Cached pages (lists of unsigned words) from least to most recently used.
+        self._dirty = {}  # Range of modified words (lowest offset, highest offset + 1) in each dirty page.
+
+    def __len__(self):
+        return self._size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.flush()
+
+    def _page_len(self, page):
+        """Return the number of words in a page (the last page may be short)."""
+
+        return min(self.page_size, self._size - page * self.page_size)
+
+    def _write_backs(self, pages):
+        """Return the list of (address, data) ranges that write the modified words of some pages back to memory."""
+
+        ranges = []
+        for page in pages:
+            if page in self._dirty:
+                (lo, hi) = self._dirty.pop(page)
+                ranges.append((page * self.page_size + lo, self._pages[page][lo:hi]))
+        return ranges
+
+    def _load(self, pages, no_fill=()):
+        """Make sure a set of pages is in the cache.
+        
+        pages = List of page numbers (no more than num_pages of them).
+        no_fill = Page numbers that will be completely overwritten so they don't have to be read from memory.
+        """
+
+        # Move the pages that are already cached to the most-recently-used end.
+        missing = []
+        for page in pages:
+            if page in self._pages:
+                self._pages[page] = self._pages.pop(page)
+            else:
+                missing.append(page)
+        if len(missing) == 0:
+            return
+
+        # Evict the least-recently-used pages to make room, writing back any that were modified.
+        num_evict = len(self._pages) + len(missing) - self.num_pages
+        evicted = list(itertools.islice(self._pages, 0, max(num_evict, 0)))
+        write_backs = self._write_backs(evicted)
+        for page in evicted:
+            del self._pages[page]
+        if len(write_backs) > 0:
+            self._memio.write_many(write_backs)
+
+        # Fetch the missing pages in a single batch.
+        fills = [page for page in missing if page not in no_fill]
+        data = self._memio.read_many([(page * self.page_size, self._page_len(page)) for page in fills],
+                                     return_type=int()) if len(fills) > 0 else []
+        for (page, words) in zip(fills, data):
+            self._pages[page] = words
+        for page in missing:
+            if page in no_fill:
+                self._pages[page] = [0] * self._page_len(page)
+
+    def _spans(self, begin_address, num_words):
+        """Generate (list of pages, begin address, # words) for groups of pages that fit in the cache."""
+
+        if begin_address < 0 or begin_address + num_words > self._size:
+            raise IndexError('Memory address out of range.')
+        end_address = begin_address + num_words
+        addr = begin_address
+        while addr < end_address:
+            group_end = min(end_address, (addr // self.page_size + self.num_pages) * self.page_size)
+            yield (range(addr // self.page_size, (group_end - 1) // self.page_size + 1), addr, group_end - addr)
+            addr = group_end
+
+    def read(self, begin_address, num_words=1):
+        """Return a list of the values in a section of the memory."""
+
+        values = []
+        for (pages, addr, n) in self._spans(begin_address, num_words):
+            self._load(pages)
+            end = addr + n
+            while addr < end:
+                (page, offset) = divmod(addr, self.page_size)
+                chunk = self._pages[page][offset:offset + end - addr]
+                values.extend(chunk)
+                addr += len(chunk)
+        if self._signed:
+            sign_bit = 1 << (self._width - 1)
+            values = [v - (sign_bit << 1) if v & sign_bit else v for v in values]
+        return values
+
+    def write(self, begin_address, data):
+        """Store a list of values into a section of the memory."""
+
+        mask = (1 << self._width) - 1
+        data = [d & mask for d in data]
+        i = 0
+        for (pages, addr, n) in self._spans(begin_address, len(data)):
+            # Pages that are completely overwritten don't need to be read from memory first.
+            no_fill = set(page for page in pages
+                          if addr <= page * self.page_size and page * self.page_size + self._page_len(page) <= addr + n)
+            self._load(pages, no_fill)
+            end = addr + n
+            while addr < end:
+                (page, offset) = divmod(addr, self.page_size)
+                words = self._pages[page]
+                m = min(len(words) - offset, end - addr)
+                words[offset:offset + m] = data[i:i + m]
+                (lo, hi) = self._dirty.get(page, (offset, offset + m))
+                self._dirty[page] = (min(lo, offset), max(hi, offset + m))
+                addr += m
+                i += m
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            (start, stop, step) = key.indices(self._size)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return self.read(start, max(stop - start, 0))
+        if key < 0:
+            key += self._size
+        return self.read(key, 1)[0]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            (start, stop, step) = key.indices(self._size)
+            value = list(value)
+            indices = range(start, stop, step)
+            if len(value) != len(indices):
+                raise ValueError('Cannot change the size of the memory.')
+            if step != 1:
+                for (i, v) in zip(indices, value):
+                    self[i] = v
+            elif len(value) > 0:
+                self.write(start, value)
+            return
+        if key < 0:
+            key += self._size
+        self.write(key, [value])
+
+    def flush(self):
+        """Write all the modified words in the cache back to the memory."""
+
+        write_backs = self._write_backs(list(self._pages))
+        if len(write_backs) > 0:
+            self._memio.write_many(write_backs)
+
+    def invalidate(self, write_back=True):
+        """Empty the cache so the next accesses get fresh data from the memory.
+        
+        write_back = False to throw away any modified words instead of writing them to the memory.
+        """
 
-        # Send the payload to write the data to memory.
-        self.send_rcv(payload=payload, num_result_bits=0)
+        if write_back:
+            self.flush()
+        self._pages.clear()
+        self._dirty.clear()
 
 
 XsMem = XsMemIo  # Associate the old XsMem class with the new XsMemIo class.
@@ -59,25 +59,45 @@ class XsSpi:
     def reset(self):
         self._memio.write(self._RESET_ADDR, [0])
 
-    def send(self, packet, stop=True):
-        """Send a packet of data to the SPI device.
-        
-        packet = The list of data to send to the device.
-        stop = True if the chip-select should be raised after sending.
-        """
+    def _make_send_payloads(self, packet, stop):
+        """Return the list of memory write payloads that send a packet to the SPI device."""
 
         if isinstance(packet, int):
             packet = [packet]
         if len(packet) == 0:
             if stop:
-                self.reset() # Reset the SPI interface to de-select the SPI device.
-            return
+                # Reset the SPI interface to de-select the SPI device.
+                return [self._memio._make_write_payload(self._RESET_ADDR, [0])]
+            return []
 
         if not stop:
-            self._memio.write(self._MULTI_XFER_ADDR, packet)
+            return [self._memio._make_write_payload(self._MULTI_XFER_ADDR, packet)]
         else:
-            self.send(packet[:-1], stop=False)
-            self._memio.write(self._SINGLE_XFER_ADDR, packet[-1:])
+            payloads = self._make_send_payloads(packet[:-1], stop=False)
+            payloads.append(self._memio._make_write_payload(self._SINGLE_XFER_ADDR, packet[-1:]))
+            return payloads
+
+    def send(self, packet, stop=True):
+        """Send a packet of data to the SPI device.
+        
+        packet = The list of data to send to the device.
+        stop = True if the chip-select should be raised after sending.
+        """
+
+        self.send_seq([(packet, stop)])
+
+    def send_seq(self, packets):
+        """Send a sequence of packets to the SPI device in a single USB transfer.
+        
+        packets = A list of (packet, stop) pairs where packet is the list of data to send
+                  and stop is True if the chip-select should be raised after sending it.
+        """
+
+        payloads = []
+        for (packet, stop) in packets:
+            payloads.extend(self._make_send_payloads(packet, stop))
+        if len(payloads) != 0:
+            self._memio.send(payloads)
             
     def receive(self, num_data=0, stop=True):
         """Receive a packet of data from the SPI slave."""
@@ -94,6 +114,26 @@ class XsSpi:
             packet.append(self._memio.read(self._SINGLE_XFER_ADDR))
             return packet
 
+    def receive_bytes(self, num_data=0, stop=True):
+        """Receive a packet of data from the SPI slave and return it as a byte array."""
+
+        data = bytearray()
+        if num_data == 0:
+            if stop:
+                self.reset() # Reset the SPI interface to de-select the SPI device.
+            return data
+
+        # Get all the data with the SPI device left selected except for the final
+        # byte which de-selects the device if stop is true.
+        num_multi = num_data - 1 if stop else num_data
+        if num_multi == 1:
+            data.append(self._memio.read(self._MULTI_XFER_ADDR, 1, return_type=int()))
+        elif num_multi > 1:
+            data.extend(self._memio.read(self._MULTI_XFER_ADDR, num_multi, return_type=int()))
+        if stop:
+            data.append(self._memio.read(self._SINGLE_XFER_ADDR, 1, return_type=int()))
+        return data
+
 if __name__ == '__main__':
     #logging.root.setLevel(logging.DEBUG)
     
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# **********************************************************************
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+#   02111-1307, USA.
+#
+#   (c)2012 - X Engineering Software Systems Corp. (www.xess.com)
+# **********************************************************************
+
+"""
+Routines for finding the transfer sizes that give the best throughput
+with an XESS board and remembering them for each board.
+"""
+
+import os
+import json
+import time
+import logging
+from xserror import *
+
+# File where the transfer sizes for each board are stored.
+XFER_SIZES_FILE = os.path.join(os.path.expanduser('~'), '.xstools', 'xfer_sizes.json')
+
+
+def measure_xfer_rates(xfer, sizes, num_bytes, repeats=2):
+    """Return a dictionary with the throughput (bytes/second) for each transfer size.
+
+    xfer = Function that moves num_bytes of data using transfers of the size it's passed.
+    sizes = List of transfer sizes to try.
+    num_bytes = Number of bytes moved by each call to xfer.
+    repeats = Number of times to call xfer for each size (the fastest time is used).
+    """
+
+    rates = {}
+    for size in sizes:
+        elapsed = []
+        for i in range(repeats):
+            start = time.time()
+            xfer(size)
+            elapsed.append(time.time() - start)
+        rates[size] = num_bytes / max(min(elapsed), 1e-6)
+        logging.debug('Transfer size %d: %d bytes/s', size, rates[size])
+    return rates
+
+
+def pick_xfer_size(rates, tolerance=0.05):
+    """Return the smallest transfer size with a throughput within a fraction (tolerance) of the best one."""
+
+    best_rate = max(rates.values())
+    return min(size for (size, rate) in rates.items() if rate >= best_rate * (1.0 - tolerance))
+
+
+def tune_xfer_size(xfer, sizes, num_bytes, tolerance=0.05):
+    """Measure the throughput of xfer for each transfer size and return the best size."""
+
+    return pick_xfer_size(measure_xfer_rates(xfer, sizes, num_bytes), tolerance)
+
+
+def _load_all_xfer_sizes(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def load_xfer_sizes(board_key, filename=XFER_SIZES_FILE):
+    """Return a dictionary of the transfer sizes stored for a board (empty if there are none)."""
+
+    xfer_sizes = _load_all_xfer_sizes(filename).get(board_key, {})
+    return dict((str(op), size) for (op, size) in xfer_sizes.items())
+
+
+def save_xfer_sizes(board_key, xfer_sizes, filename=XFER_SIZES_FILE):
+    """Store the dictionary of transfer sizes for a board."""
+
+    all_xfer_sizes = _load_all_xfer_sizes(filename)
+    all_xfer_sizes[board_key] = xfer_sizes
+    try:
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            json.dump(all_xfer_sizes, f, indent=2, sort_keys=True)
+    except (IOError, OSError) as e:
+        raise XsMinorError('Unable to save transfer sizes to %s: %s' % (filename, e))
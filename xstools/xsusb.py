@@ -179,6 +179,17 @@ class XsUsb:
                 return index
         return None
 
+    def get_location(self):
+        """Return a string identifying where the board is attached in the USB hierarchy."""
+
+        if self._dev is None:
+            return None
+        # Use the bus number and the chain of hub ports leading to the board if they're available.
+        ports = getattr(self._dev, 'port_numbers', None)
+        if ports:
+            return '%d-%s' % (self._dev.bus, '.'.join([str(p) for p in ports]))
+        return '%d' % self._dev.bus
+
     def __init__(self, xsusb_id=0, endpoint=1):
         """Initiate a USB connection to an XESS board."""
 
@@ -189,6 +200,8 @@ class XsUsb:
         self._dev = devs[xsusb_id]
         self._endpoint = endpoint
         self.terminate = False
+        self.return_enabled = True  # Board sends responses to commands.
+        self._return_control = None  # Whether the firmware can stop sending responses (None if not checked yet).
         
     def _calc_time_out(self,num_bytes):
         """Calculate USB transaction interval (in milliseconds) for a given bit-rate."""
@@ -225,6 +238,43 @@ class XsUsb:
                       str([bin(x | 0x100)[3:] for x in bytes]))
         return bytes
 
+    def disable_return(self):
+        """Stop the board from sending responses to commands.
+        
+        This lets a batch of write-only commands be streamed to the board without
+        waiting for each response. Call enable_return() at the end of the batch.
+        """
+
+        cmd = bytearray([self.DISABLE_RETURN_CMD])
+        self.write(cmd)
+        self.return_enabled = False
+
+    def is_return_control_supported(self):
+        """Return true if the firmware can stop sending responses to commands.
+        
+        This is checked once by asking the board to keep sending responses. Firmware
+        that doesn't know the command never sends back the echo.
+        """
+
+        if self._return_control == None:
+            cmd = bytearray([self.ENABLE_RETURN_CMD])
+            self.write(cmd)
+            try:
+                self._return_control = self.read(1)[0] == cmd[0]
+            except (XsError, usb.core.USBError):
+                self._return_control = False
+            logging.debug('Firmware response control supported = %s', self._return_control)
+        return self._return_control
+
+    def enable_return(self):
+        """Make the board send responses to commands again and check the preceding batch got through."""
+
+        cmd = bytearray([self.ENABLE_RETURN_CMD])
+        self.write(cmd)
+        self.return_enabled = True
+        if self.read(1)[0] != cmd[0]:
+            raise XsMajorError('Communication error with XESS board after sending commands without responses.')
+
     def set_prog(self, level):
         """Change the level on the PROG# pin of the FPGA."""
 
@@ -94,6 +94,13 @@ def xsusbprg():
             default=False,
             help=
             'Verify the microcontroller flash against the firmware hex file.')
+        p.add_argument(
+            '-i', '--incremental',
+            action='store_const',
+            const=True,
+            default=False,
+            help=
+            'Only reprogram the sections of the microcontroller flash that differ from the firmware hex file.')
         p.add_argument(
             '-v', '--version',
             action='version',
@@ -112,7 +119,7 @@ def xsusbprg():
                         print 'Verification passed!'
                     else:
                         print 'Programming microcontroller firmware with %s.' % args.filename
-                        xs_board.update_firmware(args.filename)
+                        xs_board.update_firmware(args.filename, args.incremental)
                         print 'Programming completed!'
                 except XSERROR.XsError as e:
                     try: